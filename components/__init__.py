@@ -1,15 +1,12 @@
 """
 TRPG DM 插件组件模块
+
+组件按需懒加载（PEP 562），首次访问某个名称时才导入对应子模块
+静态类型信息见同目录的 __init__.pyi
 """
 
-from .commands import (
-    TRPGCommand,
-    DiceShortcut,
-    set_services,
-    set_config,
-)
-from .handlers import TRPGMessageHandler, TRPGStartupHandler, TRPGShutdownHandler
-from .tools import RollDiceTool, CheckPlayerStatusTool, GetWorldStateTool, ModifyPlayerStatusTool, SearchLoreTool
+import importlib
+from types import MappingProxyType
 
 __all__ = [
     # Commands
@@ -28,3 +25,47 @@ __all__ = [
     "ModifyPlayerStatusTool",
     "SearchLoreTool",
 ]
+
+# 公开名称 -> 所在子模块（模块级只读常量，__getattr__ 中不再构造）
+_DYNAMIC_IMPORTS = MappingProxyType({
+    "TRPGCommand": ".commands",
+    "DiceShortcut": ".commands",
+    "TRPGMessageHandler": ".handlers",
+    "TRPGStartupHandler": ".handlers",
+    "TRPGShutdownHandler": ".handlers",
+    "RollDiceTool": ".tools",
+    "CheckPlayerStatusTool": ".tools",
+    "GetWorldStateTool": ".tools",
+    "ModifyPlayerStatusTool": ".tools",
+    "SearchLoreTool": ".tools",
+})
+
+
+def set_services(*args, **kwargs):
+    """设置服务引用（首次调用后替换为 commands.set_services 本身）"""
+    global set_services
+    from .commands import set_services as _set_services
+    set_services = _set_services
+    return _set_services(*args, **kwargs)
+
+
+def set_config(*args, **kwargs):
+    """设置配置引用（首次调用后替换为 commands.set_config 本身）"""
+    global set_config
+    from .commands import set_config as _set_config
+    set_config = _set_config
+    return _set_config(*args, **kwargs)
+
+
+def __getattr__(name: str):
+    module_name = _DYNAMIC_IMPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    # 写回模块字典，之后的访问走普通属性查找，不再进入 __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return __all__
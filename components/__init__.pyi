@@ -0,0 +1,33 @@
+from .commands import (
+    TRPGCommand as TRPGCommand,
+    DiceShortcut as DiceShortcut,
+    set_services as set_services,
+    set_config as set_config,
+)
+from .handlers import (
+    TRPGMessageHandler as TRPGMessageHandler,
+    TRPGStartupHandler as TRPGStartupHandler,
+    TRPGShutdownHandler as TRPGShutdownHandler,
+)
+from .tools import (
+    RollDiceTool as RollDiceTool,
+    CheckPlayerStatusTool as CheckPlayerStatusTool,
+    GetWorldStateTool as GetWorldStateTool,
+    ModifyPlayerStatusTool as ModifyPlayerStatusTool,
+    SearchLoreTool as SearchLoreTool,
+)
+
+__all__ = [
+    "TRPGCommand",
+    "DiceShortcut",
+    "set_services",
+    "set_config",
+    "TRPGMessageHandler",
+    "TRPGStartupHandler",
+    "TRPGShutdownHandler",
+    "RollDiceTool",
+    "CheckPlayerStatusTool",
+    "GetWorldStateTool",
+    "ModifyPlayerStatusTool",
+    "SearchLoreTool",
+]
@@ -3,10 +3,15 @@ TRPG DM 插件命令组件 - 统一命令系统
 所有命令统一使用 /trpg 前缀
 """
 
+import asyncio
 import re
-from typing import Tuple, Optional, TYPE_CHECKING
+from collections import defaultdict
+from types import MappingProxyType
+from typing import Any, Dict, List, Tuple, Optional, TYPE_CHECKING
 from src.plugin_system import BaseCommand
 from src.common.logger import get_logger
+from ..models.player import ATTRIBUTE_NAMES, DEFAULT_MIN_ATTRIBUTE, DEFAULT_MAX_ATTRIBUTE
+from ..services.dice import DiceExpressionError
 
 if TYPE_CHECKING:
     from ..models.storage import StorageManager
@@ -22,6 +27,13 @@ _dice_service: Optional["DiceService"] = None
 _dm_engine: Optional["DMEngine"] = None
 _module_loader: Optional["ModuleLoader"] = None
 _plugin_config: dict = {}
+_admin_user_ids: frozenset = frozenset()
+# 加点上下限，在 set_config 中转换一次
+_min_attribute: int = DEFAULT_MIN_ATTRIBUTE
+_max_attribute: int = DEFAULT_MAX_ATTRIBUTE
+# 中途加入开关，在 set_config 中读取一次
+_allow_mid_join: bool = True
+_mid_join_require_confirm: bool = False
 
 
 def set_services(storage: "StorageManager", dice: "DiceService", dm: "DMEngine", loader: "ModuleLoader" = None):
@@ -35,95 +47,76 @@ def set_services(storage: "StorageManager", dice: "DiceService", dm: "DMEngine",
 
 def set_config(config: dict):
     """设置配置引用"""
-    global _plugin_config
+    global _plugin_config, _admin_user_ids, _min_attribute, _max_attribute
+    global _allow_mid_join, _mid_join_require_confirm
     _plugin_config = config
+    admin_users = config.get("permissions", {}).get("admin_users", [])
+    _admin_user_ids = frozenset(str(a) for a in admin_users)
+    player_cfg = config.get("player", {})
+    _min_attribute = int(player_cfg.get("min_attribute", DEFAULT_MIN_ATTRIBUTE))
+    _max_attribute = int(player_cfg.get("max_attribute", DEFAULT_MAX_ATTRIBUTE))
+    session_cfg = config.get("session", {})
+    _allow_mid_join = session_cfg.get("allow_mid_join", True)
+    _mid_join_require_confirm = session_cfg.get("mid_join_require_confirm", False)
 
 
-def _is_admin(user_id: str) -> bool:
-    """检查用户是否是管理员"""
-    admin_users = _plugin_config.get("permissions", {}).get("admin_users", [])
-    return str(user_id) in [str(a) for a in admin_users]
+# 后台任务引用，防止运行中的任务被垃圾回收
+_background_tasks: set = set()
 
 
-# ============================================================
-# 统一 TRPG 命令 - 所有功能通过 /trpg 访问
-# ============================================================
+def _spawn_background(coro) -> asyncio.Task:
+    """在后台运行耗时的 LLM 调用，不阻塞命令的即时回应"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    task.add_done_callback(_log_background_failure)
+    return task
 
-class TRPGCommand(BaseCommand):
-    """
-    统一的 TRPG 命令处理器
-    
-    命令格式: /trpg <子命令> [参数]
-    
-    子命令列表:
-    - help: 显示帮助
-    - start [模组]: 开始跑团
-    - end: 结束跑团
-    - status: 查看状态
-    - join [角色名]: 加入游戏
-    - pc [show|set|leave]: 角色管理
-    - r/roll [表达式]: 掷骰子
-    - inv [add|rm|use]: 背包管理
-    - hp/mp [+/-n]: 修改属性
-    - dm [子命令]: DM控制
-    - slot [list|save|load]: 存档管理
-    - module [list|info]: 模组管理
-    """
-    
-    command_name = "trpg_unified"
-    command_description = "TRPG 跑团统一命令"
-    # 匹配 /trpg 后跟可选的子命令和参数
-    command_pattern = r"^/trpg(?:\s+(?P<subcmd>\S+))?(?:\s+(?P<args>.*))?$"
 
-    async def execute(self) -> Tuple[bool, Optional[str], int]:
-        if not _storage:
-            return False, "插件未正确初始化", 0
-        
-        subcmd = (self.matched_groups.get("subcmd") or "help").lower()
-        args = (self.matched_groups.get("args") or "").strip()
-        
-        # 路由到对应的处理方法
-        handlers = {
-            "help": self._help,
-            "h": self._help,
-            "start": self._start,
-            "end": self._end,
-            "status": self._status,
-            "s": self._status,
-            "join": self._join,
-            "j": self._join,
-            "pc": self._pc,
-            "r": self._roll,
-            "roll": self._roll,
-            "inv": self._inventory,
-            "i": self._inventory,
-            "hp": self._hp,
-            "mp": self._mp,
-            "dm": self._dm,
-            "slot": self._slot,
-            "save": self._save,
-            "module": self._module,
-            "mod": self._module,
-            "lore": self._lore,
-            "scene": self._scene,
-            "confirm": self._confirm,
-            "pause": self._pause,
-            "resume": self._resume,
-        }
-        
-        handler = handlers.get(subcmd)
-        if handler:
-            return await handler(args)
-        
-        # 未知子命令，显示帮助
-        await self.send_text(f"⚠️ 未知命令: /trpg {subcmd}\n使用 /trpg help 查看帮助")
-        return False, "未知命令", 0
+def _log_background_failure(task: asyncio.Task):
+    """记录后台任务中未处理的异常"""
+    if not task.cancelled() and task.exception():
+        logger.error(f"后台任务失败: {task.exception()}")
 
 
-    # ==================== 帮助 ====================
-    async def _help(self, args: str) -> Tuple[bool, Optional[str], int]:
-        """显示帮助信息"""
-        help_text = """🎲 MaiBot TRPG DM 跑团插件
+async def _is_current_session(session) -> bool:
+    """后台任务完成时，判断会话是否仍是该群组当前的会话对象（期间可能已结束或重新开始）"""
+    return await _storage.get_session(session.stream_id) is session
+
+
+def _split_action(args: str, default: str = "") -> Tuple[str, str]:
+    """把子命令参数拆成 (小写动作, 其余参数)，只切分一次"""
+    parts = args.split(maxsplit=1)
+    if not parts:
+        return default, ""
+    return parts[0].lower(), parts[1] if len(parts) > 1 else ""
+
+
+# 数值参数的最大位数
+MAX_INT_DIGITS = 9
+
+
+def _parse_int(text: str) -> Optional[int]:
+    """解析可带 +/- 号的整数（最多 MAX_INT_DIGITS 位），格式不对或位数超限时返回 None"""
+    digits = text[1:] if text[:1] in ("+", "-") else text
+    if not digits.isdecimal() or len(digits) > MAX_INT_DIGITS:
+        return None
+    return int(text)
+
+
+def _int_error(text: str, invalid_msg: str) -> str:
+    """_parse_int 失败时的提示：是整数但位数超限时提示超出范围，否则返回 invalid_msg"""
+    digits = text[1:] if text[:1] in ("+", "-") else text
+    if digits.isdecimal():
+        return f"⚠️ 数值超出范围（最多 {MAX_INT_DIGITS} 位）"
+    return invalid_msg
+
+
+# /trpg inv 参数: <动作> [物品名] [数量]
+_INV_ARGS_RE = re.compile(r"^(\S+)(?:\s+(.*?))?(?:\s+(\d+))?\s*$", re.DOTALL)
+
+# /trpg help 帮助文本
+HELP_TEXT = """🎲 MaiBot TRPG DM 跑团插件
 
 ━━━ 📋 会话管理 ━━━
 /trpg start [模组]  开始跑团
@@ -171,15 +164,143 @@ class TRPGCommand(BaseCommand):
 *动作描述*  （动作）  "对话"
 
 🌟 快速开始: /trpg start solo_mystery"""
+
+# 静态提示文本
+ATTRIBUTE_HINT = "属性: 力量/str 敏捷/dex 体质/con 智力/int 感知/wis 魅力/cha"
+
+JOIN_GUIDE_TEXT = f"""━━━ 加点说明 ━━━
+/trpg pc add 属性 点数  分配属性点
+/trpg pc reset         重置所有加点
+/trpg pc lock          锁定角色（完成加点）
+
+{ATTRIBUTE_HINT}"""
+
+PC_HELP_TEXT = f"""📋 角色管理命令:
+/trpg pc show        查看角色卡
+/trpg pc add 属性 点数  分配属性点
+/trpg pc sub 属性 点数  减少属性点
+/trpg pc reset       重置所有加点
+/trpg pc lock        锁定角色
+/trpg pc leave       离开跑团
+
+{ATTRIBUTE_HINT}"""
+
+DM_HELP_TEXT = """🎮 DM命令:
+/trpg dm time [时间]
+/trpg dm weather [天气]
+/trpg dm location [位置]
+/trpg dm npc [名称] [动作]
+/trpg dm event [描述]
+/trpg dm describe"""
+
+# /trpg dm 世界状态设置: 动作 -> (WorldState 字段, 历史记录前缀, 回复前缀)
+DM_WORLD_SETTERS = {
+    "time": ("time_of_day", "时间变为", "🕐 时间"),
+    "weather": ("weather", "天气变为", "🌤️ 天气"),
+    "location": ("location", "场景转换", "📍 位置"),
+}
+
+# 模组列表显示用
+GENRE_NAMES = {"fantasy": "🗡️奇幻", "horror": "👻恐怖", "scifi": "🚀科幻", "modern": "🏙️现代"}
+DIFFICULTY_ICONS = {"easy": "🟢", "normal": "🟡", "hard": "🔴"}
+# /trpg confirm 支持的操作，先校验再取出待确认请求
+CONFIRM_ACTIONS = frozenset({"accept", "reject"})
+
+
+# 模组列表渲染缓存: (模组列表对象, 渲染结果)
+# 按列表对象身份判断是否可复用，无需逐项比对；传入新的列表对象时总会重新渲染
+_module_listing_cache: Optional[Tuple[List[Dict[str, Any]], str]] = None
+
+
+def _render_module_groups(modules: List[Dict[str, Any]]) -> str:
+    """按类型分组渲染模组列表，模组列表未变化时直接复用上次结果"""
+    global _module_listing_cache
+    if _module_listing_cache and _module_listing_cache[0] is modules:
+        return _module_listing_cache[1]
+    
+    by_genre = defaultdict(list)
+    for m in modules:
+        by_genre[m.get("genre", "其他")].append(m)
+    
+    parts = []
+    for genre, mods in by_genre.items():
+        parts.append(f"\n{GENRE_NAMES.get(genre, genre)}:\n")
+        for m in mods:
+            parts.append(f"  {DIFFICULTY_ICONS.get(m.get('difficulty'), '⚪')} {m['name']} ({m['id']})\n")
+    
+    text = "".join(parts)
+    _module_listing_cache = (modules, text)
+    return text
+
+
+def _is_admin(user_id: str) -> bool:
+    """检查用户是否是管理员"""
+    return str(user_id) in _admin_user_ids
+
+
+# ============================================================
+# 统一 TRPG 命令 - 所有功能通过 /trpg 访问
+# ============================================================
+
+class TRPGCommand(BaseCommand):
+    """
+    统一的 TRPG 命令处理器
+    
+    命令格式: /trpg <子命令> [参数]
+    
+    子命令列表:
+    - help: 显示帮助
+    - start [模组]: 开始跑团
+    - end: 结束跑团
+    - status: 查看状态
+    - join [角色名]: 加入游戏
+    - pc [show|set|leave]: 角色管理
+    - r/roll [表达式]: 掷骰子
+    - inv [add|rm|use]: 背包管理
+    - hp/mp [+/-n]: 修改属性
+    - dm [子命令]: DM控制
+    - slot [list|save|load]: 存档管理
+    - module [list|info]: 模组管理
+    """
+    
+    command_name = "trpg_unified"
+    command_description = "TRPG 跑团统一命令"
+    # 匹配 /trpg 后跟可选的子命令和参数
+    command_pattern = r"^/trpg(?:\s+(?P<subcmd>\S+))?(?:\s+(?P<args>.*))?$"
+
+    async def execute(self) -> Tuple[bool, Optional[str], int]:
+        if not _storage:
+            return False, "插件未正确初始化", 0
+        
+        groups = self.matched_groups
+        subcmd = (groups.get("subcmd") or "help").lower()
+        args = (groups.get("args") or "").strip()
+        
+        # 子命令共用的上下文，只解析一次
+        self._stream_id = self.message.chat_stream.stream_id
+        self._user_id = str(self.message.message_info.user_info.user_id)
+        
+        # 路由到对应的处理方法（分发表在类定义末尾构建）
+        handler = self._SUBCOMMAND_HANDLERS.get(subcmd)
+        if handler:
+            return await handler(self, args)
         
-        await self.send_text(help_text)
+        # 未知子命令，显示帮助
+        await self.send_text(f"⚠️ 未知命令: /trpg {subcmd}\n使用 /trpg help 查看帮助")
+        return False, "未知命令", 0
+
+
+    # ==================== 帮助 ====================
+    async def _help(self, args: str) -> Tuple[bool, Optional[str], int]:
+        """显示帮助信息"""
+        await self.send_text(HELP_TEXT)
         return True, None, 2
 
 
     # ==================== 会话管理 ====================
     async def _start(self, args: str) -> Tuple[bool, Optional[str], int]:
         """开始跑团会话"""
-        stream_id = self.message.chat_stream.stream_id
+        stream_id = self._stream_id
         
         existing = await _storage.get_session(stream_id)
         if existing and existing.is_active():
@@ -212,18 +333,22 @@ class TRPGCommand(BaseCommand):
         
         # 自由模式
         session = await _storage.create_session(stream_id, args)
-        intro = await _dm_engine.generate_session_intro(session)
         session.add_history("system", f"跑团开始: {args}")
-        await _storage.save_session(session)
+        _storage.schedule_save(session)
         
-        await self.send_text(f"""🎲 跑团开始！
-
-世界观: {args}
-{intro}
-
-📋 使用 /trpg join [角色名] 加入冒险""")
+        # 开场白由 LLM 生成，先回应再在后台补发
+        await self.send_text(f"🎲 跑团开始！\n\n世界观: {args}\n✍️ DM 正在准备开场...")
+        _spawn_background(self._send_session_intro(session))
         return True, "跑团会话已开始", 2
 
+    async def _send_session_intro(self, session):
+        """后台生成并发送开场白"""
+        intro = await _dm_engine.generate_session_intro(session)
+        # 生成期间已开始新的跑团时，不把旧开场白发到新游戏里
+        if not await _is_current_session(session):
+            return
+        await self.send_text(f"{intro}\n\n📋 使用 /trpg join [角色名] 加入冒险")
+
     async def _show_module_list(self) -> Tuple[bool, Optional[str], int]:
         """显示模组选择列表"""
         if not _module_loader:
@@ -231,29 +356,17 @@ class TRPGCommand(BaseCommand):
             return False, "模组系统未初始化", 0
         
         modules = _module_loader.list_available_modules()
-        genre_names = {"fantasy": "🗡️奇幻", "horror": "👻恐怖", "scifi": "🚀科幻", "modern": "🏙️现代"}
-        diff_icons = {"easy": "🟢", "normal": "🟡", "hard": "🔴"}
-        
-        by_genre = {}
-        for m in modules:
-            genre = m.get("genre", "其他")
-            by_genre.setdefault(genre, []).append(m)
-        
-        text = "🎲 请选择模组:\n"
-        for genre, mods in by_genre.items():
-            text += f"\n{genre_names.get(genre, genre)}:\n"
-            for m in mods:
-                text += f"  {diff_icons.get(m.get('difficulty'), '⚪')} {m['name']} ({m['id']})\n"
         
-        text += "\n📝 /trpg start [模组ID] 或 /trpg start [自定义世界观]"
-        await self.send_text(text)
+        await self.send_text(
+            f"🎲 请选择模组:\n{_render_module_groups(modules)}\n📝 /trpg start [模组ID] 或 /trpg start [自定义世界观]"
+        )
         return True, None, 2
 
 
     async def _end(self, args: str) -> Tuple[bool, Optional[str], int]:
         """结束跑团会话"""
-        stream_id = self.message.chat_stream.stream_id
-        user_id = str(self.message.message_info.user_info.user_id)
+        stream_id = self._stream_id
+        user_id = self._user_id
         session = await _storage.get_session(stream_id)
         
         if not session:
@@ -265,7 +378,7 @@ class TRPGCommand(BaseCommand):
             return False, "权限不足", 0
         
         session.add_history("system", "跑团结束")
-        await _storage.save_session(session)
+        # end_session 会把结束状态连同这条历史一起写盘
         await _storage.end_session(stream_id)
         
         await self.send_text("🎲 跑团结束！感谢各位冒险者的参与！")
@@ -273,7 +386,7 @@ class TRPGCommand(BaseCommand):
 
     async def _status(self, args: str) -> Tuple[bool, Optional[str], int]:
         """显示会话状态"""
-        stream_id = self.message.chat_stream.stream_id
+        stream_id = self._stream_id
         session = await _storage.get_session(stream_id)
         
         if not session:
@@ -281,7 +394,7 @@ class TRPGCommand(BaseCommand):
             return True, None, 2
         
         players = await _storage.get_players_in_session(stream_id)
-        player_list = "\n".join([f"  • {p.character_name}" for p in players]) or "  暂无"
+        player_list = "\n".join(f"  • {p.character_name}" for p in players) or "  暂无"
         
         await self.send_text(f"""📋 跑团状态
 
@@ -297,19 +410,21 @@ class TRPGCommand(BaseCommand):
 
     async def _save(self, args: str) -> Tuple[bool, Optional[str], int]:
         """手动保存"""
-        stream_id = self.message.chat_stream.stream_id
+        stream_id = self._stream_id
         session = await _storage.get_session(stream_id)
         
         if not session:
             return False, "⚠️ 当前没有跑团会话", 2
         
+        # 先写出合并窗口内待保存的玩家数据
+        await _storage.flush_pending(stream_id)
         await _storage.save_session(session)
         await self.send_text("💾 存档已保存！")
         return True, "已保存", 2
 
     async def _pause(self, args: str) -> Tuple[bool, Optional[str], int]:
         """暂停会话"""
-        stream_id = self.message.chat_stream.stream_id
+        stream_id = self._stream_id
         session = await _storage.get_session(stream_id)
         
         if not session:
@@ -317,13 +432,13 @@ class TRPGCommand(BaseCommand):
         
         session.status = "paused"
         session.add_history("system", "跑团暂停")
-        await _storage.save_session(session)
+        _storage.schedule_save(session)
         await self.send_text("⏸️ 跑团已暂停，使用 /trpg resume 继续")
         return True, "已暂停", 2
 
     async def _resume(self, args: str) -> Tuple[bool, Optional[str], int]:
         """恢复会话"""
-        stream_id = self.message.chat_stream.stream_id
+        stream_id = self._stream_id
         session = await _storage.get_session(stream_id)
         
         if not session:
@@ -334,7 +449,7 @@ class TRPGCommand(BaseCommand):
         
         session.status = "active"
         session.add_history("system", "跑团继续")
-        await _storage.save_session(session)
+        _storage.schedule_save(session)
         await self.send_text("▶️ 跑团继续！")
         return True, "已继续", 2
 
@@ -342,8 +457,8 @@ class TRPGCommand(BaseCommand):
     # ==================== 玩家操作 ====================
     async def _join(self, args: str) -> Tuple[bool, Optional[str], int]:
         """加入跑团"""
-        stream_id = self.message.chat_stream.stream_id
-        user_id = str(self.message.message_info.user_info.user_id)
+        stream_id = self._stream_id
+        user_id = self._user_id
         character_name = args.strip() or "无名冒险者"
         
         session = await _storage.get_session(stream_id)
@@ -361,15 +476,12 @@ class TRPGCommand(BaseCommand):
             return False, "已加入", 0
 
         # 中途加入控制（对已有人加入的会话生效）
-        session_config = _plugin_config.get("session", {})
-        allow_mid_join = session_config.get("allow_mid_join", True)
-        if not allow_mid_join and session.player_ids:
+        if not _allow_mid_join and session.player_ids:
             await self.send_text("⚠️ 本跑团不允许中途加入")
             return False, "不允许中途加入", 0
 
         # 中途加入确认（管理员）
-        mid_join_require_confirm = session_config.get("mid_join_require_confirm", False)
-        if mid_join_require_confirm and not _is_admin(user_id):
+        if _mid_join_require_confirm and not _is_admin(user_id):
             pending = _storage.get_pending_join(stream_id, user_id)
             if pending:
                 await self.send_text("📝 你已有待确认的加入请求，请等待管理员处理")
@@ -382,9 +494,9 @@ class TRPGCommand(BaseCommand):
             )
             return True, "待确认", 2
         
-        player = await _storage.create_player(stream_id, user_id, character_name)
+        # create_player 会把玩家加入会话并保存会话，先记历史即可一次写盘
         session.add_history("system", f"{character_name} 加入了冒险", user_id=user_id)
-        await _storage.save_session(session)
+        player = await _storage.create_player(stream_id, user_id, character_name)
         
         await self.send_text(f"""🎭 欢迎 {character_name} 加入冒险！
 
@@ -392,18 +504,13 @@ class TRPGCommand(BaseCommand):
 
 {player.get_points_display()}
 
-━━━ 加点说明 ━━━
-/trpg pc add 属性 点数  分配属性点
-/trpg pc reset         重置所有加点
-/trpg pc lock          锁定角色（完成加点）
-
-属性: 力量/str 敏捷/dex 体质/con 智力/int 感知/wis 魅力/cha""")
+{JOIN_GUIDE_TEXT}""")
         return True, f"{character_name} 加入", 2
 
     async def _pc(self, args: str) -> Tuple[bool, Optional[str], int]:
         """角色管理"""
-        stream_id = self.message.chat_stream.stream_id
-        user_id = str(self.message.message_info.user_info.user_id)
+        stream_id = self._stream_id
+        user_id = self._user_id
         
         player = await _storage.get_player(stream_id, user_id)
         if not player:
@@ -422,22 +529,19 @@ class TRPGCommand(BaseCommand):
         elif action == "add" and len(parts) >= 2:
             # 加点: /trpg pc add 力量 3
             attr_name = parts[1]
-            try:
-                points = int(parts[2]) if len(parts) >= 3 else 1
-            except ValueError:
-                await self.send_text("⚠️ 点数必须是整数")
+            points = _parse_int(parts[2]) if len(parts) >= 3 else 1
+            if points is None:
+                await self.send_text(_int_error(parts[2], "⚠️ 点数必须是整数"))
                 return False, "无效数值", 0
             if points <= 0:
                 await self.send_text("⚠️ 点数必须为正数")
                 return False, "无效数值", 0
 
-            player_cfg = _plugin_config.get("player", {})
-            min_attr = int(player_cfg.get("min_attribute", 3))
-            max_attr = int(player_cfg.get("max_attribute", 18))
-            
-            success, msg = player.allocate_point(attr_name, points, min_attribute=min_attr, max_attribute=max_attr)
+            success, msg = player.allocate_point(
+                attr_name, points, min_attribute=_min_attribute, max_attribute=_max_attribute
+            )
             if success:
-                await _storage.save_player(player)
+                _storage.schedule_player_save(player)
                 await self.send_text(f"✅ {msg}")
             else:
                 await self.send_text(f"⚠️ {msg}")
@@ -446,22 +550,19 @@ class TRPGCommand(BaseCommand):
         elif action == "sub" and len(parts) >= 2:
             # 减点: /trpg pc sub 力量 2
             attr_name = parts[1]
-            try:
-                points = int(parts[2]) if len(parts) >= 3 else 1
-            except ValueError:
-                await self.send_text("⚠️ 点数必须是整数")
+            points = _parse_int(parts[2]) if len(parts) >= 3 else 1
+            if points is None:
+                await self.send_text(_int_error(parts[2], "⚠️ 点数必须是整数"))
                 return False, "无效数值", 0
             if points <= 0:
                 await self.send_text("⚠️ 点数必须为正数")
                 return False, "无效数值", 0
 
-            player_cfg = _plugin_config.get("player", {})
-            min_attr = int(player_cfg.get("min_attribute", 3))
-            max_attr = int(player_cfg.get("max_attribute", 18))
-            
-            success, msg = player.allocate_point(attr_name, -points, min_attribute=min_attr, max_attribute=max_attr)
+            success, msg = player.allocate_point(
+                attr_name, -points, min_attribute=_min_attribute, max_attribute=_max_attribute
+            )
             if success:
-                await _storage.save_player(player)
+                _storage.schedule_player_save(player)
                 await self.send_text(f"✅ {msg}")
             else:
                 await self.send_text(f"⚠️ {msg}")
@@ -471,7 +572,7 @@ class TRPGCommand(BaseCommand):
             # 重置加点
             success, msg = player.reset_points()
             if success:
-                await _storage.save_player(player)
+                _storage.schedule_player_save(player)
                 await self.send_text(f"✅ {msg}")
             else:
                 await self.send_text(f"⚠️ {msg}")
@@ -508,16 +609,17 @@ class TRPGCommand(BaseCommand):
                 return False, "权限不足", 0
             
             attr_name, attr_value = parts[1], parts[2]
-            try:
-                value = int(attr_value)
-                if player.attributes.set_attribute(attr_name, value):
-                    await _storage.save_player(player)
-                    await self.send_text(f"✅ [管理员] 已将 {attr_name} 设置为 {value}")
-                    return True, None, 2
+            if attr_name.lower() not in ATTRIBUTE_NAMES:
                 await self.send_text(f"⚠️ 未知属性: {attr_name}")
-            except ValueError:
-                await self.send_text(f"⚠️ 无效数值: {attr_value}")
-            return False, "设置失败", 0
+                return False, "设置失败", 0
+            value = _parse_int(attr_value)
+            if value is None:
+                await self.send_text(_int_error(attr_value, f"⚠️ 无效数值: {attr_value}"))
+                return False, "设置失败", 0
+            player.attributes.set_attribute(attr_name, value)
+            await _storage.save_player(player)
+            await self.send_text(f"✅ [管理员] 已将 {attr_name} 设置为 {value}")
+            return True, None, 2
         
         elif action == "leave":
             name = player.character_name
@@ -525,35 +627,26 @@ class TRPGCommand(BaseCommand):
             await self.send_text(f"👋 {name} 离开了冒险...")
             return True, "离开", 2
         
-        await self.send_text("""📋 角色管理命令:
-/trpg pc show        查看角色卡
-/trpg pc add 属性 点数  分配属性点
-/trpg pc sub 属性 点数  减少属性点
-/trpg pc reset       重置所有加点
-/trpg pc lock        锁定角色
-/trpg pc leave       离开跑团
-
-属性: 力量/str 敏捷/dex 体质/con 智力/int 感知/wis 魅力/cha""")
+        await self.send_text(PC_HELP_TEXT)
         return False, "格式错误", 0
 
     async def _hp(self, args: str) -> Tuple[bool, Optional[str], int]:
         """修改HP"""
-        stream_id = self.message.chat_stream.stream_id
-        user_id = str(self.message.message_info.user_info.user_id)
+        stream_id = self._stream_id
+        user_id = self._user_id
         
         player = await _storage.get_player(stream_id, user_id)
         if not player:
             await self.send_text("⚠️ 你还没有加入跑团！")
             return False, "未加入", 0
         
-        try:
-            amount = int(args) if args else 0
-        except ValueError:
-            await self.send_text("⚠️ 请输入有效数值，如 /trpg hp +5 或 /trpg hp -3")
+        amount = _parse_int(args) if args else 0
+        if amount is None:
+            await self.send_text(_int_error(args, "⚠️ 请输入有效数值，如 /trpg hp +5 或 /trpg hp -3"))
             return False, "无效数值", 0
         
         old_hp, new_hp = player.modify_hp(amount)
-        await _storage.save_player(player)
+        _storage.schedule_player_save(player)
         
         change = f"+{amount}" if amount > 0 else str(amount)
         status = " 💀 倒下了！" if new_hp <= 0 else ""
@@ -562,22 +655,21 @@ class TRPGCommand(BaseCommand):
 
     async def _mp(self, args: str) -> Tuple[bool, Optional[str], int]:
         """修改MP"""
-        stream_id = self.message.chat_stream.stream_id
-        user_id = str(self.message.message_info.user_info.user_id)
+        stream_id = self._stream_id
+        user_id = self._user_id
         
         player = await _storage.get_player(stream_id, user_id)
         if not player:
             await self.send_text("⚠️ 你还没有加入跑团！")
             return False, "未加入", 0
         
-        try:
-            amount = int(args) if args else 0
-        except ValueError:
-            await self.send_text("⚠️ 请输入有效数值")
+        amount = _parse_int(args) if args else 0
+        if amount is None:
+            await self.send_text(_int_error(args, "⚠️ 请输入有效数值"))
             return False, "无效数值", 0
         
         old_mp, new_mp = player.modify_mp(amount)
-        await _storage.save_player(player)
+        _storage.schedule_player_save(player)
         
         change = f"+{amount}" if amount > 0 else str(amount)
         await self.send_text(f"💙 MP: {old_mp} → {new_mp}/{player.mp_max} ({change})")
@@ -587,8 +679,8 @@ class TRPGCommand(BaseCommand):
     # ==================== 背包系统 ====================
     async def _inventory(self, args: str) -> Tuple[bool, Optional[str], int]:
         """背包管理"""
-        stream_id = self.message.chat_stream.stream_id
-        user_id = str(self.message.message_info.user_info.user_id)
+        stream_id = self._stream_id
+        user_id = self._user_id
         
         player = await _storage.get_player(stream_id, user_id)
         if not player:
@@ -599,38 +691,29 @@ class TRPGCommand(BaseCommand):
             await self.send_text(player.get_inventory_display())
             return True, None, 2
         
-        parts = args.split(maxsplit=2)
-        action = parts[0].lower()
-        
-        # 解析物品名和数量
-        item_args = " ".join(parts[1:]) if len(parts) > 1 else ""
-        item_name = item_args
-        quantity = 1
-        
-        if item_args:
-            item_parts = item_args.rsplit(None, 1)
-            if len(item_parts) == 2 and item_parts[1].isdigit():
-                item_name = item_parts[0]
-                quantity = int(item_parts[1])
+        # 一次匹配解析 动作 / 物品名 / 数量
+        action, item_name, quantity_str = _INV_ARGS_RE.match(args).groups()
+        action = action.lower()
+        item_name = item_name or ""
+        quantity = int(quantity_str) if quantity_str else 1
         
         if action == "add" and item_name:
             player.add_item(item_name, quantity)
-            await _storage.save_player(player)
+            _storage.schedule_player_save(player)
             await self.send_text(f"✅ 获得了 {item_name} x{quantity}")
             return True, None, 2
         
         elif action in ("rm", "remove") and item_name:
             if player.remove_item(item_name, quantity):
-                await _storage.save_player(player)
+                _storage.schedule_player_save(player)
                 await self.send_text(f"✅ 移除了 {item_name} x{quantity}")
                 return True, None, 2
             await self.send_text(f"⚠️ 背包中没有 {item_name}")
             return False, "物品不存在", 0
         
         elif action == "use" and item_name:
-            if player.get_item(item_name):
-                player.remove_item(item_name, 1)
-                await _storage.save_player(player)
+            if player.remove_item(item_name, 1):
+                _storage.schedule_player_save(player)
                 await self.send_text(f"✨ 使用了 {item_name}！")
                 return True, None, 2
             await self.send_text(f"⚠️ 背包中没有 {item_name}")
@@ -649,27 +732,27 @@ class TRPGCommand(BaseCommand):
         
         try:
             result = _dice_service.roll(expression)
-            await self.send_text(result.get_display())
-            
-            # 记录到历史
-            stream_id = self.message.chat_stream.stream_id
-            session = await _storage.get_session(stream_id)
-            if session and session.is_active():
-                user_id = str(self.message.message_info.user_info.user_id)
-                player = await _storage.get_player(stream_id, user_id)
-                session.add_history(
-                    "dice", f"{expression} = {result.total}",
-                    user_id=user_id,
-                    character_name=player.character_name if player else None,
-                    extra_data={"rolls": result.rolls, "total": result.total}
-                )
-                await _storage.save_session(session)
-            
-            return True, None, 2
-        except Exception as e:
-            logger.error(f"掷骰子失败: {e}")
+        except DiceExpressionError as e:
             await self.send_text(f"⚠️ 骰子表达式无效: {expression}")
             return False, str(e), 0
+        
+        await self.send_text(result.get_display())
+        
+        # 记录到历史（无活跃会话时同步判定后直接返回）
+        stream_id = self._stream_id
+        if _storage.has_active_session(stream_id):
+            session = await _storage.get_session(stream_id)
+            user_id = self._user_id
+            player = await _storage.get_player(stream_id, user_id)
+            session.add_history(
+                "dice", f"{expression} = {result.total}",
+                user_id=user_id,
+                character_name=player.character_name if player else None,
+                extra_data={"rolls": result.rolls, "total": result.total}
+            )
+            _storage.schedule_save(session)
+        
+        return True, None, 2
 
 
     # ==================== DM 控制 ====================
@@ -678,101 +761,89 @@ class TRPGCommand(BaseCommand):
         if not _dm_engine:
             return False, "DM引擎未初始化", 0
 
-        user_id = str(self.message.message_info.user_info.user_id)
+        user_id = self._user_id
         if not _is_admin(user_id):
             await self.send_text("⚠️ 只有管理员可以使用 DM 命令")
             return False, "权限不足", 0
         
-        stream_id = self.message.chat_stream.stream_id
+        stream_id = self._stream_id
         session = await _storage.get_session(stream_id)
         
         if not session:
             await self.send_text("⚠️ 当前没有跑团会话")
             return False, "无会话", 0
         
-        parts = args.split(maxsplit=1)
-        action = parts[0].lower() if parts else ""
-        value = parts[1] if len(parts) > 1 else ""
-        
-        if action == "time" and value:
-            session.world_state.time_of_day = value
-            session.add_history("system", f"时间变为: {value}")
-            await _storage.save_session(session)
-            await self.send_text(f"🕐 时间: {value}")
-            return True, None, 2
+        action, value = _split_action(args)
         
-        elif action == "weather" and value:
-            session.world_state.weather = value
-            session.add_history("system", f"天气变为: {value}")
-            await _storage.save_session(session)
-            await self.send_text(f"🌤️ 天气: {value}")
+        # 时间/天气/位置共用一条查表路径
+        world_setter = DM_WORLD_SETTERS.get(action)
+        if world_setter and value:
+            field_name, history_prefix, reply_prefix = world_setter
+            setattr(session.world_state, field_name, value)
+            session.add_history("system", f"{history_prefix}: {value}")
+            _storage.schedule_save(session)
+            await self.send_text(f"{reply_prefix}: {value}")
             return True, None, 2
         
-        elif action == "location" and value:
-            session.world_state.location = value
-            session.add_history("system", f"场景转换: {value}")
-            await _storage.save_session(session)
-            await self.send_text(f"📍 位置: {value}")
-            return True, None, 2
-        
-        elif action == "npc" and value:
+        if action == "npc" and value:
             npc_parts = value.split(maxsplit=1)
             npc_name = npc_parts[0]
             npc_action = npc_parts[1] if len(npc_parts) > 1 else ""
             
             if npc_name not in session.npcs:
                 session.add_npc(npc_name)
+                # 先持久化新 NPC，不依赖后台对话生成是否成功
+                _storage.schedule_save(session)
             
             if npc_action:
-                response = await _dm_engine.generate_npc_dialogue(session, npc_name, npc_action)
-                session.add_history("dm", response)
-                await _storage.save_session(session)
-                await self.send_text(response)
+                _spawn_background(self._send_dm_text(
+                    session, _dm_engine.generate_npc_dialogue(session, npc_name, npc_action)
+                ))
             else:
                 await self.send_text(f"✅ NPC {npc_name} 已添加")
             return True, None, 2
         
         elif action == "event" and value:
             session.add_history("dm", f"[事件] {value}")
-            await _storage.save_session(session)
+            _storage.schedule_save(session)
             await self.send_text(f"⚡ 事件: {value}")
             return True, None, 2
         
         elif action == "describe":
-            description = await _dm_engine.describe_environment(session)
-            session.add_history("dm", description)
-            await _storage.save_session(session)
-            await self.send_text(description)
+            _spawn_background(self._send_dm_text(session, _dm_engine.describe_environment(session)))
             return True, None, 2
         
-        await self.send_text("""🎮 DM命令:
-/trpg dm time [时间]
-/trpg dm weather [天气]
-/trpg dm location [位置]
-/trpg dm npc [名称] [动作]
-/trpg dm event [描述]
-/trpg dm describe""")
+        await self.send_text(DM_HELP_TEXT)
         return True, None, 2
 
+    async def _send_dm_text(self, session, generation):
+        """等待后台 DM 生成完成，记录历史并发送"""
+        text = await generation
+        # 会话已被替换时只发送文本，避免旧会话写回覆盖新会话的存档
+        if await _is_current_session(session):
+            session.add_history("dm", text)
+            _storage.schedule_save(session)
+        await self.send_text(text)
+
     # ==================== 存档系统 ====================
     async def _slot(self, args: str) -> Tuple[bool, Optional[str], int]:
         """存档插槽管理"""
-        stream_id = self.message.chat_stream.stream_id
+        stream_id = self._stream_id
         
-        parts = args.split()
-        action = parts[0].lower() if parts else "list"
-        slot_num = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+        action, rest = _split_action(args, "list")
+        slot_arg = rest.split(maxsplit=1)[0] if rest else ""
+        slot_num = int(slot_arg) if slot_arg.isdecimal() else None
         
         if action == "list":
             slots = await _storage.list_save_slots(stream_id)
-            text = "💾 存档插槽:\n"
+            parts = ["💾 存档插槽:\n"]
             for slot in slots:
                 sn = slot["slot"]
                 if slot.get("exists"):
-                    text += f"\n📁 插槽 {sn}: {slot.get('world_name', '?')} 👥{slot.get('player_count', 0)}\n"
+                    parts.append(f"\n📁 插槽 {sn}: {slot.get('world_name', '?')} 👥{slot.get('player_count', 0)}\n")
                 else:
-                    text += f"\n📁 插槽 {sn}: (空)\n"
-            await self.send_text(text)
+                    parts.append(f"\n📁 插槽 {sn}: (空)\n")
+            await self.send_text("".join(parts))
             return True, None, 2
         
         elif action == "save" and slot_num:
@@ -797,7 +868,7 @@ class TRPGCommand(BaseCommand):
             return success, msg, 2
         
         elif action == "delete" and slot_num:
-            user_id = str(self.message.message_info.user_info.user_id)
+            user_id = self._user_id
             if not _is_admin(user_id):
                 await self.send_text("⚠️ 只有管理员可以删除存档")
                 return False, "权限不足", 0
@@ -816,9 +887,7 @@ class TRPGCommand(BaseCommand):
             await self.send_text("⚠️ 模组系统未初始化")
             return False, "未初始化", 0
         
-        parts = args.split(maxsplit=1)
-        action = parts[0].lower() if parts else "list"
-        module_id = parts[1] if len(parts) > 1 else ""
+        action, module_id = _split_action(args, "list")
         
         if action == "list":
             modules = _module_loader.list_available_modules()
@@ -826,21 +895,7 @@ class TRPGCommand(BaseCommand):
                 await self.send_text("📚 暂无可用模组")
                 return True, None, 2
             
-            genre_names = {"fantasy": "🗡️奇幻", "horror": "👻恐怖", "scifi": "🚀科幻", "modern": "🏙️现代"}
-            diff_icons = {"easy": "🟢", "normal": "🟡", "hard": "🔴"}
-            
-            by_genre = {}
-            for m in modules:
-                by_genre.setdefault(m.get("genre", "其他"), []).append(m)
-            
-            text = "📚 可用模组:\n"
-            for genre, mods in by_genre.items():
-                text += f"\n{genre_names.get(genre, genre)}:\n"
-                for m in mods:
-                    text += f"  {diff_icons.get(m.get('difficulty'), '⚪')} {m['name']} ({m['id']})\n"
-            
-            text += "\n使用 /trpg mod info [ID] 查看详情"
-            await self.send_text(text)
+            await self.send_text(f"📚 可用模组:\n{_render_module_groups(modules)}\n使用 /trpg mod info [ID] 查看详情")
             return True, None, 2
         
         elif action == "info" and module_id:
@@ -872,16 +927,14 @@ class TRPGCommand(BaseCommand):
     # ==================== 世界观设定 ====================
     async def _lore(self, args: str) -> Tuple[bool, Optional[str], int]:
         """世界观设定管理"""
-        stream_id = self.message.chat_stream.stream_id
+        stream_id = self._stream_id
         session = await _storage.get_session(stream_id)
         
         if not session:
             await self.send_text("⚠️ 当前没有跑团会话")
             return False, "无会话", 0
         
-        parts = args.split(maxsplit=1)
-        action = parts[0].lower() if parts else ""
-        content = parts[1] if len(parts) > 1 else ""
+        action, content = _split_action(args)
         
         if action == "add" and content:
             await _storage.add_lore(stream_id, content)
@@ -891,18 +944,21 @@ class TRPGCommand(BaseCommand):
         elif action == "search" and content:
             results = await _storage.search_lore(stream_id, content)
             if results:
-                text = "📚 搜索结果:\n" + "\n".join([f"• {r}" for r in results[:5]])
+                text = "\n".join(["📚 搜索结果:", *(f"• {r}" for r in results[:5])])
             else:
                 text = f"📚 未找到与 '{content}' 相关的设定"
             await self.send_text(text)
             return True, None, 2
         
         # 显示所有设定
-        lore = await _storage.get_lore(stream_id)
+        lore = await _storage.get_lore(stream_id, limit=10)
         if lore:
-            text = "📚 世界观设定:\n" + "\n".join([f"• {l}" for l in lore[:10]])
-            if len(lore) > 10:
-                text += f"\n... 还有 {len(lore) - 10} 条"
+            lines = ["📚 世界观设定:"]
+            lines.extend(f"• {l}" for l in lore)
+            total = await _storage.count_lore(stream_id)
+            if total > 10:
+                lines.append(f"... 还有 {total - 10} 条")
+            text = "\n".join(lines)
         else:
             text = "📚 暂无设定\n使用 /trpg lore add [内容] 添加"
         await self.send_text(text)
@@ -912,7 +968,7 @@ class TRPGCommand(BaseCommand):
     # ==================== 场景图片 ====================
     async def _scene(self, args: str) -> Tuple[bool, Optional[str], int]:
         """生成场景图片"""
-        stream_id = self.message.chat_stream.stream_id
+        stream_id = self._stream_id
         session = await _storage.get_session(stream_id)
         
         if not session or not session.is_active():
@@ -925,30 +981,29 @@ class TRPGCommand(BaseCommand):
             return False, "功能未启用", 0
         
         await self.send_text("🎨 正在生成场景图片...")
+        _spawn_background(self._send_scene_image(session, args))
+        return True, "图片生成中", 2
+
+    async def _send_scene_image(self, session, description: str):
+        """后台生成并发送场景图片"""
+        from ..services.image_generator import get_image_generator
         
-        try:
-            from ..services.image_generator import ImageGenerator
-            generator = ImageGenerator(_plugin_config)
-            success, result = await generator.generate_scene_image(session, args)
-            
-            if success:
-                await self.send_image_base64(result)
+        # 生成器内部捕获提示词与生图请求的异常，失败统一通过返回值报告
+        success, result = await get_image_generator(_plugin_config).generate_scene_image(session, description)
+        
+        if success:
+            await self.send_image_base64(result)
+            if await _is_current_session(session):
                 session.add_history("system", "生成了场景图片")
-                await _storage.save_session(session)
-                return True, "图片生成成功", 2
-            
+                _storage.schedule_save(session)
+        else:
             await self.send_text(f"⚠️ 生成失败: {result}")
-            return False, result, 0
-        except Exception as e:
-            logger.error(f"生成场景图片失败: {e}")
-            await self.send_text(f"⚠️ 生成失败: {e}")
-            return False, str(e), 0
 
     # ==================== 管理员确认 ====================
     async def _confirm(self, args: str) -> Tuple[bool, Optional[str], int]:
         """确认/拒绝玩家加入请求"""
-        stream_id = self.message.chat_stream.stream_id
-        user_id = str(self.message.message_info.user_info.user_id)
+        stream_id = self._stream_id
+        user_id = self._user_id
         
         if not _is_admin(user_id):
             await self.send_text("⚠️ 只有管理员可以确认加入请求")
@@ -959,18 +1014,20 @@ class TRPGCommand(BaseCommand):
         target_user = parts[1] if len(parts) > 1 else ""
         
         if not action:
-            pending = _storage.get_all_pending_joins(stream_id)
-            if not pending:
+            if not _storage.has_pending_joins(stream_id):
                 await self.send_text("📋 没有待确认的加入请求")
                 return True, None, 2
             
-            text = "📋 待确认请求:\n"
-            for uid, char_name in pending.items():
-                text += f"• {char_name} (ID: {uid})\n"
-            text += "\n/trpg confirm accept [ID] 确认\n/trpg confirm reject [ID] 拒绝"
-            await self.send_text(text)
+            parts = ["📋 待确认请求:\n"]
+            parts.extend(f"• {char_name} (ID: {uid})\n" for uid, char_name in _storage.iter_pending_joins(stream_id))
+            parts.append("\n/trpg confirm accept [ID] 确认\n/trpg confirm reject [ID] 拒绝")
+            await self.send_text("".join(parts))
             return True, None, 2
         
+        if action not in CONFIRM_ACTIONS:
+            await self.send_text("⚠️ 未知操作，可用: accept / reject")
+            return False, "未知操作", 0
+        
         if not target_user:
             await self.send_text("⚠️ 请指定用户ID")
             return False, "缺少参数", 0
@@ -981,19 +1038,44 @@ class TRPGCommand(BaseCommand):
             return False, "请求不存在", 0
         
         if action == "accept":
-            player = await _storage.create_player(stream_id, target_user, character_name)
             session = await _storage.get_session(stream_id)
             if session:
                 session.add_history("system", f"{character_name} 加入了冒险（管理员确认）")
-                await _storage.save_session(session)
+            await _storage.create_player(stream_id, target_user, character_name)
             await self.send_text(f"✅ 已确认 {character_name} 加入！")
             return True, "已确认", 2
         
-        elif action == "reject":
-            await self.send_text(f"❌ 已拒绝 {character_name} 的请求")
-            return True, "已拒绝", 2
-        
-        return False, "未知操作", 0
+        await self.send_text(f"❌ 已拒绝 {character_name} 的请求")
+        return True, "已拒绝", 2
+
+    # 子命令分发表：类加载时构建一次并冻结为只读映射，execute 中只做一次字典查找
+    _SUBCOMMAND_HANDLERS = MappingProxyType({
+        "help": _help,
+        "h": _help,
+        "start": _start,
+        "end": _end,
+        "status": _status,
+        "s": _status,
+        "join": _join,
+        "j": _join,
+        "pc": _pc,
+        "r": _roll,
+        "roll": _roll,
+        "inv": _inventory,
+        "i": _inventory,
+        "hp": _hp,
+        "mp": _mp,
+        "dm": _dm,
+        "slot": _slot,
+        "save": _save,
+        "module": _module,
+        "mod": _module,
+        "lore": _lore,
+        "scene": _scene,
+        "confirm": _confirm,
+        "pause": _pause,
+        "resume": _resume,
+    })
 
 
 # ============================================================
@@ -1013,8 +1095,9 @@ class DiceShortcut(BaseCommand):
         expr = self.matched_groups.get("expr") or "d20"
         try:
             result = _dice_service.roll(expr)
-            await self.send_text(result.get_display())
-            return True, None, 2
-        except Exception as e:
+        except DiceExpressionError as e:
             await self.send_text(f"⚠️ 骰子表达式无效: {expr}")
             return False, str(e), 0
+        
+        await self.send_text(result.get_display())
+        return True, None, 2
@@ -14,6 +14,7 @@ from src.plugin_system import (
     CustomEventHandlerResult,
 )
 from src.common.logger import get_logger
+from ..models.session import ActionRecord
 
 if TYPE_CHECKING:
     from ..models.storage import StorageManager
@@ -34,9 +35,89 @@ _storage: Optional["StorageManager"] = None
 _dm_engine: Optional["DMEngine"] = None
 _plugin_config: dict = {}
 
+# 处理器使用的配置项，由 set_handler_services 一次性解析
+_takeover_message: bool = True
+_block_other_plugins: bool = True
+_allow_mid_join: bool = True
+_mid_join_require_confirm: bool = False
+_show_action_feedback: bool = True
+_auto_narrative: bool = True
+_batch_actions: bool = True
+_process_when_all_ready: bool = True
+_action_collect_window: float = DEFAULT_ACTION_COLLECT_WINDOW
+_action_reminder_interval: float = DEFAULT_ACTION_REMINDER_INTERVAL
+_max_retries: int = DEFAULT_MAX_RETRIES
+_retry_delay: float = DEFAULT_RETRY_DELAY
+_climax_auto_image: bool = False
+
 # 多人行动收集器（按 stream_id 分组）
 _action_collectors: Dict[str, "ActionCollector"] = {}
 
+# 跑团命令识别正则（/trpg 与 /r、/roll 合并为一次匹配，模块加载时编译）
+_TRPG_COMMAND_RE = re.compile(r"^/(?:trpg|r|roll)(?:\s|$)", re.IGNORECASE)
+
+# 角色扮演格式识别正则：*动作*、（动作）、(动作)、"对话"、“对话”整句包裹，或以【角色】开头
+# 单字符 "*" 与 '"' 首尾同字符，与原 startswith/endswith 判定保持一致
+_ROLEPLAY_RE = re.compile(r'(?:\*(?:.*\*)?|（.*）|\(.*\)|"(?:.*")?|“.*”)\Z|【.*】', re.DOTALL)
+
+# 动作描述格式（*动作*、（动作）、(动作)），用于生成动作确认
+_ACTION_WRAP_RE = re.compile(r'\*(?:.*\*)?|（.*）|\(.*\)', re.DOTALL)
+
+# DM 响应判定的行动关键词，合并为一个正则，一次扫描完成全部关键词匹配
+DM_ACTION_KEYWORDS = (
+    "我要", "我想", "我尝试", "我试着", "我决定",
+    "攻击", "使用", "查看", "检查", "调查", "搜索",
+    "走向", "前往", "进入", "离开", "移动",
+    "说", "问", "告诉", "询问", "回答",
+    "拿", "捡", "打开", "关闭", "推", "拉",
+    "躲", "藏", "逃跑", "战斗", "施法",
+)
+_DM_ACTION_KEYWORD_RE = re.compile("|".join(map(re.escape, DM_ACTION_KEYWORDS)))
+
+
+def _compile_keyword_table(table) -> tuple:
+    """把 (关键词元组, 结果) 列表编译为 (正则, 结果)，保持原有的优先级顺序"""
+    return tuple(
+        (re.compile("|".join(map(re.escape, keywords))), result)
+        for keywords, result in table
+    )
+
+
+# 动作确认：需要检定的动作类型（emoji, 检定名, 骰子）
+_ACK_CHECK_ACTIONS = _compile_keyword_table([
+    (("搜索", "调查", "检查", "查看", "观察", "寻找", "翻找"), ("🔍", "感知检定", "d20")),
+    (("攻击", "战斗", "打", "砍", "刺"), ("⚔️", "攻击检定", "d20")),
+    (("说服", "劝说", "欺骗", "撒谎", "威胁", "恐吓"), ("💬", "魅力检定", "d20")),
+    (("跳", "爬", "翻", "躲", "闪", "滚"), ("🤸", "敏捷检定", "d20")),
+    (("推", "拉", "举", "砸", "破门", "撞"), ("💪", "力量检定", "d20")),
+    (("回忆", "分析", "推理", "识破", "辨认"), ("🧠", "智力检定", "d20")),
+    (("潜行", "隐藏", "躲藏", "偷偷", "悄悄"), ("🫥", "隐匿检定", "d20")),
+    (("开锁", "撬", "拆", "修理", "解除"), ("🔧", "巧手检定", "d20")),
+])
+
+# 动作确认：不需要检定的简单动作
+_ACK_SIMPLE_ACTIONS = _compile_keyword_table([
+    (("打开", "开门"), "🚪"),
+    (("拿", "捡", "获取"), "🤲"),
+    (("走向", "前往", "进入", "离开", "移动"), "🚶"),
+    (("使用",), "✨"),
+    (("逃跑", "逃"), "🏃"),
+    (("施法", "魔法"), "🪄"),
+    (("说", "问", "告诉", "询问", "回答", "对话"), "💬"),
+])
+
+# 角色扮演格式动作的检定提示（检定名, 骰子）
+_CHECK_HINTS = _compile_keyword_table([
+    (("搜索", "调查", "检查", "查看", "观察", "寻找"), ("感知检定", "d20")),
+    (("攻击", "战斗", "打", "砍", "刺"), ("攻击检定", "d20")),
+    (("说服", "劝说", "欺骗", "威胁"), ("魅力检定", "d20")),
+    (("跳", "爬", "翻", "躲", "闪"), ("敏捷检定", "d20")),
+    (("推", "拉", "举", "砸", "破"), ("力量检定", "d20")),
+    (("回忆", "分析", "推理", "识破"), ("智力检定", "d20")),
+    (("潜行", "隐藏", "躲藏", "偷偷"), ("隐匿检定", "d20")),
+    (("开锁", "撬", "拆", "修理"), ("巧手检定", "d20")),
+])
+
 
 class ActionCollector:
     """
@@ -59,20 +140,18 @@ class ActionCollector:
         self.max_wait_time = max_wait_time
         self.reminder_interval = reminder_interval
         
-        self.actions: Dict[str, Dict] = {}  # {user_id: {character_name, action, timestamp}}
+        self.actions: Dict[str, ActionRecord] = {}  # {user_id: ActionRecord}
         self.first_action_time: Optional[float] = None
         self.is_processing: bool = False    # 是否正在处理中
         
-        self._lock = asyncio.Lock()
-        self._timeout_task: Optional[asyncio.Task] = None
-        self._reminder_task: Optional[asyncio.Task] = None
+        self._round_task: Optional[asyncio.Task] = None
         self._handler_ref = None  # 用于发送消息的 handler 引用
     
     def set_handler(self, handler):
         """设置 handler 引用用于发送消息"""
         self._handler_ref = handler
     
-    async def add_action(
+    def add_action(
         self, 
         user_id: str, 
         character_name: str, 
@@ -81,6 +160,8 @@ class ActionCollector:
         """
         添加一个行动
         
+        方法体内没有 await，在事件循环中天然原子执行，无需加锁
+        
         Returns:
             (is_first, all_ready, current_count, total_count)
             - is_first: 是否是第一个行动（需要启动定时器）
@@ -88,29 +169,23 @@ class ActionCollector:
             - current_count: 当前已行动人数
             - total_count: 总玩家数
         """
-        async with self._lock:
-            if self.is_processing:
-                return False, False, len(self.actions), self.total_players
-            
-            now = time.time()
-            is_first = self.first_action_time is None
-            
-            # 记录或更新行动
-            is_update = user_id in self.actions
-            self.actions[user_id] = {
-                "user_id": user_id,
-                "character_name": character_name,
-                "action": action,
-                "timestamp": now,
-            }
-            
-            if is_first:
-                self.first_action_time = now
-            
-            current_count = len(self.actions)
-            all_ready = current_count >= self.total_players
-            
-            return is_first and not is_update, all_ready, current_count, self.total_players
+        if self.is_processing:
+            return False, False, len(self.actions), self.total_players
+        
+        now = time.time()
+        is_first = self.first_action_time is None
+        
+        # 记录或更新行动
+        is_update = user_id in self.actions
+        self.actions[user_id] = ActionRecord(user_id, character_name, action, now)
+        
+        if is_first:
+            self.first_action_time = now
+        
+        current_count = len(self.actions)
+        all_ready = current_count >= self.total_players
+        
+        return is_first and not is_update, all_ready, current_count, self.total_players
     
     def get_missing_players(self) -> List[str]:
         """获取尚未行动的玩家ID列表"""
@@ -120,14 +195,13 @@ class ActionCollector:
         """获取已行动的玩家ID列表"""
         return list(self.actions.keys())
     
-    async def get_and_clear(self) -> List[Dict]:
+    def get_and_clear(self) -> List[ActionRecord]:
         """获取所有收集的行动并清空"""
-        async with self._lock:
-            actions = list(self.actions.values())
-            self.actions = {}
-            self.first_action_time = None
-            self.is_processing = False
-            return actions
+        actions = list(self.actions.values())
+        self.actions = {}
+        self.first_action_time = None
+        self.is_processing = False
+        return actions
     
     def get_action_count(self) -> int:
         """获取当前收集的行动数量"""
@@ -137,50 +211,87 @@ class ActionCollector:
         """标记为正在处理"""
         self.is_processing = True
     
-    def start_timeout_task(self, callback):
-        """启动超时任务"""
-        if self._timeout_task and not self._timeout_task.done():
-            self._timeout_task.cancel()
-        
-        async def timeout_handler():
-            await asyncio.sleep(self.max_wait_time)
-            await callback()
+    def start_round_timer(self, on_timeout, on_reminder):
+        """
+        启动本轮计时任务
         
-        self._timeout_task = asyncio.create_task(timeout_handler())
-    
-    def start_reminder_task(self, callback):
-        """启动提醒任务"""
-        if self._reminder_task and not self._reminder_task.done():
-            self._reminder_task.cancel()
+        每轮只占用一个任务：按 reminder_interval 提醒未行动玩家，
+        到达 max_wait_time 后调用 on_timeout 处理已收集的行动
+        """
+        self.cancel_all_tasks()
         
-        async def reminder_handler():
+        async def round_timer():
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.max_wait_time
             while True:
-                await asyncio.sleep(self.reminder_interval)
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(self.reminder_interval, remaining))
                 if self.is_processing:
+                    return
+                if loop.time() >= deadline:
                     break
                 missing = self.get_missing_players()
                 if missing:
-                    await callback(missing)
-                else:
-                    break
+                    await on_reminder(missing)
+            # 进入超时处理后与收集器脱钩：处理期间新一轮的行动不能再取消本任务（否则会丢弃正在生成的 DM 响应）
+            if self._round_task is asyncio.current_task():
+                self._round_task = None
+            await on_timeout()
         
-        self._reminder_task = asyncio.create_task(reminder_handler())
+        self._round_task = asyncio.create_task(round_timer())
     
     def cancel_all_tasks(self):
-        """取消所有待处理任务"""
-        if self._timeout_task and not self._timeout_task.done():
-            self._timeout_task.cancel()
-        if self._reminder_task and not self._reminder_task.done():
-            self._reminder_task.cancel()
-
+        """取消本轮仍在等待或提醒阶段的计时任务（已进入超时处理的任务不受影响）"""
+        task = self._round_task
+        self._round_task = None
+        if task and not task.done():
+            task.cancel()
 
 def set_handler_services(storage: "StorageManager", dm: "DMEngine", config: dict):
     """设置服务引用"""
     global _storage, _dm_engine, _plugin_config
+    global _takeover_message, _block_other_plugins, _allow_mid_join, _mid_join_require_confirm
+    global _show_action_feedback, _auto_narrative, _batch_actions, _process_when_all_ready
+    global _action_collect_window, _action_reminder_interval, _max_retries, _retry_delay
+    global _climax_auto_image
     _storage = storage
     _dm_engine = dm
     _plugin_config = config
 
+    integration_config = config.get("integration", {})
+    _takeover_message = integration_config.get("takeover_message", True)
+    _block_other_plugins = integration_config.get("block_other_plugins", True)
+
+    session_config = config.get("session", {})
+    _allow_mid_join = session_config.get("allow_mid_join", True)
+    _mid_join_require_confirm = session_config.get("mid_join_require_confirm", False)
+
+    dm_config = config.get("dm", {})
+    _show_action_feedback = dm_config.get("show_action_feedback", True)
+    _auto_narrative = dm_config.get("auto_narrative", True)
+    _max_retries = dm_config.get("max_retries", DEFAULT_MAX_RETRIES)
+    _retry_delay = dm_config.get("retry_delay", DEFAULT_RETRY_DELAY)
+
+    multiplayer_config = config.get("multiplayer", {})
+    _batch_actions = multiplayer_config.get("batch_actions", True)
+    _process_when_all_ready = multiplayer_config.get("process_when_all_ready", True)
+    _action_collect_window = multiplayer_config.get("action_collect_window", DEFAULT_ACTION_COLLECT_WINDOW)
+    _action_reminder_interval = multiplayer_config.get("reminder_interval", DEFAULT_ACTION_REMINDER_INTERVAL)
+
+    # 高潮自动画图需要同时启用图片生成与 climax_auto_image
+    image_config = config.get("image", {})
+    _climax_auto_image = image_config.get("enabled", False) and image_config.get("climax_auto_image", True)
+
+
+def _extract_user_id(message) -> Optional[str]:
+    """从消息基础信息中取出发送者 ID，缺失时返回 None"""
+    try:
+        return str(message.message_base_info["user_info"]["user_id"])
+    except (KeyError, TypeError):
+        return None
+
 
 class TRPGMessageHandler(BaseEventHandler):
     """
@@ -231,21 +342,15 @@ class TRPGMessageHandler(BaseEventHandler):
         # 命令消息处理
         if plain_text.startswith("/"):
             # 检查是否是跑团相关命令 - 统一使用 /trpg 前缀，保留 /r 快捷命令
-            is_trpg_command = bool(re.match(r"^/(?:trpg)(?:\s|$)", plain_text, re.IGNORECASE)) or bool(
-                re.match(r"^/(?:r|roll)(?:\s|$)", plain_text, re.IGNORECASE)
-            )
-            
-            integration_config = _plugin_config.get("integration", {})
-            takeover = integration_config.get("takeover_message", True)
+            is_trpg_command = _TRPG_COMMAND_RE.match(plain_text) is not None
             
             if is_trpg_command:
                 # 跑团命令，让命令处理器处理，但阻止其他插件
-                block_others = integration_config.get("block_other_plugins", True)
-                return True, not block_others, None, None, None
+                return True, not _block_other_plugins, None, None, None
             else:
                 # 非跑团命令：根据 takeover_message 配置决定是否放行
                 # 如果完全接管模式，则阻止其他命令；否则放行
-                if takeover:
+                if _takeover_message:
                     # 完全接管模式下，忽略非跑团命令（不处理也不放行给 MaiBot）
                     return True, False, None, None, None
                 else:
@@ -253,11 +358,7 @@ class TRPGMessageHandler(BaseEventHandler):
                     return True, True, None, None, None
         
         # 获取用户信息
-        user_id = None
-        if message.message_base_info:
-            user_info = message.message_base_info.get("user_info", {})
-            user_id = str(user_info.get("user_id", ""))
-        
+        user_id = _extract_user_id(message)
         if not user_id:
             return True, True, None, None, None
         
@@ -265,24 +366,18 @@ class TRPGMessageHandler(BaseEventHandler):
         player = await _storage.get_player(stream_id, user_id)
         
         # 检查是否允许中途加入
-        session_config = _plugin_config.get("session", {})
-        allow_mid_join = session_config.get("allow_mid_join", True)
-        mid_join_require_confirm = session_config.get("mid_join_require_confirm", False)
-        
-        if not player and not allow_mid_join:
+        if not player and not _allow_mid_join:
             # 不允许中途加入，忽略非玩家消息但仍阻止其他插件
-            integration_config = _plugin_config.get("integration", {})
-            if integration_config.get("takeover_message", True):
+            if _takeover_message:
                 return True, False, None, None, None
             return True, True, None, None, None
         
         # 检查是否有待确认的加入请求
-        if not player and mid_join_require_confirm:
+        if not player and _mid_join_require_confirm:
             pending = _storage.get_pending_join(stream_id, user_id)
             if pending:
                 # 已有待确认请求，忽略消息
-                integration_config = _plugin_config.get("integration", {})
-                if integration_config.get("takeover_message", True):
+                if _takeover_message:
                     return True, False, None, None, None
                 return True, True, None, None, None
         
@@ -292,7 +387,6 @@ class TRPGMessageHandler(BaseEventHandler):
         
         if should_respond:
             character_name = player.character_name if player else "旁观者"
-            dm_config = _plugin_config.get("dm", {})
             
             # 记录玩家行动到历史
             session.add_history(
@@ -301,23 +395,20 @@ class TRPGMessageHandler(BaseEventHandler):
                 user_id=user_id,
                 character_name=character_name,
             )
-            await _storage.save_session(session)
+            _storage.schedule_save(session)
             
             # 立即发送动作确认反馈（如果启用）
-            if dm_config.get("show_action_feedback", True):
+            if _show_action_feedback:
                 action_ack = self._generate_action_acknowledgment(plain_text, character_name)
                 if action_ack:
                     await self.send_text(stream_id, action_ack)
             
             # 检查是否启用自动叙述
-            if dm_config.get("auto_narrative", True):
-                # 检查多人模式配置
-                multiplayer_config = _plugin_config.get("multiplayer", {})
-                batch_mode = multiplayer_config.get("batch_actions", True)
+            if _auto_narrative:
                 player_count = len(session.player_ids)
                 
                 # 只有多人（>=2）且启用批量模式时才收集行动
-                if batch_mode and player_count >= 2:
+                if _batch_actions and player_count >= 2:
                     await self._handle_multiplayer_action(
                         stream_id, session, user_id, character_name, plain_text, player
                     )
@@ -331,8 +422,7 @@ class TRPGMessageHandler(BaseEventHandler):
                 await self.send_text(stream_id, f"📝 已记录 {character_name} 的行动")
         
         # 根据配置决定是否阻止其他插件处理
-        integration_config = _plugin_config.get("integration", {})
-        if integration_config.get("takeover_message", True):
+        if _takeover_message:
             # 完全接管，阻止后续处理
             return True, False, None, None, None
         
@@ -345,57 +435,49 @@ class TRPGMessageHandler(BaseEventHandler):
         """处理多人模式下的行动收集 - 等待所有玩家行动"""
         global _action_collectors
         
-        multiplayer_config = _plugin_config.get("multiplayer", {})
-        max_wait_time = multiplayer_config.get("action_collect_window", DEFAULT_ACTION_COLLECT_WINDOW)
-        reminder_interval = multiplayer_config.get("reminder_interval", DEFAULT_ACTION_REMINDER_INTERVAL)
-        
-        # 获取所有玩家
-        all_players = await _storage.get_players_in_session(stream_id)
-        player_ids = [p.user_id for p in all_players]
-        total_players = len(player_ids)
-        
-        # 获取或创建行动收集器
-        if stream_id not in _action_collectors or _action_collectors[stream_id].is_processing:
-            _action_collectors[stream_id] = ActionCollector(
-                stream_id=stream_id,
-                total_players=total_players,
-                player_ids=player_ids,
-                max_wait_time=max_wait_time,
-                reminder_interval=reminder_interval,
-            )
+        # 获取或创建行动收集器（玩家名单只在每轮开始时读取一次，由收集器保存到本轮结束）
+        collector = _action_collectors.get(stream_id)
+        if collector is None or collector.is_processing:
+            players = await _storage.get_players_in_session(stream_id)
+            # await 期间可能已有其他消息创建了本轮收集器，重新检查后再创建（检查与赋值之间不再 await）
+            collector = _action_collectors.get(stream_id)
+            if collector is None or collector.is_processing:
+                player_ids = [p.user_id for p in players]
+                collector = ActionCollector(
+                    stream_id=stream_id,
+                    total_players=len(player_ids),
+                    player_ids=player_ids,
+                    max_wait_time=_action_collect_window,
+                    reminder_interval=_action_reminder_interval,
+                )
+                _action_collectors[stream_id] = collector
         
-        collector = _action_collectors[stream_id]
         collector.set_handler(self)
         
         # 添加行动
-        is_first, all_ready, current_count, total_count = await collector.add_action(
+        is_first, all_ready, current_count, total_count = collector.add_action(
             user_id, character_name, action
         )
         
         if is_first:
             # 第一个行动，启动等待
-            logger.info(f"[TRPGHandler] 多人模式：开始收集行动，等待所有 {total_count} 名玩家（最长 {max_wait_time} 秒）")
+            logger.info(f"[TRPGHandler] 多人模式：开始收集行动，等待所有 {total_count} 名玩家（最长 {_action_collect_window} 秒）")
             
             # 发送等待提示
             await self.send_text(
                 stream_id, 
                 f"⏳ 等待其他玩家行动... ({current_count}/{total_count})\n"
-                f"💡 最长等待 {int(max_wait_time)} 秒，或所有玩家行动后立即处理"
+                f"💡 最长等待 {int(_action_collect_window)} 秒，或所有玩家行动后立即处理"
             )
             
-            # 启动超时任务
+            # 超时处理
             async def on_timeout():
                 await self._process_collected_actions(stream_id, timeout=True)
             
-            collector.start_timeout_task(on_timeout)
-            
-            # 启动提醒任务
+            # 提醒未行动玩家
             async def on_reminder(missing_ids: List[str]):
-                missing_players = []
-                for pid in missing_ids:
-                    p = await _storage.get_player(stream_id, pid)
-                    if p:
-                        missing_players.append(p.character_name)
+                players_by_id = await _storage.get_players_by_ids(stream_id, missing_ids)
+                missing_players = [p.character_name for p in players_by_id.values()]
                 
                 if missing_players:
                     acted_count = collector.get_action_count()
@@ -405,7 +487,7 @@ class TRPGMessageHandler(BaseEventHandler):
                         f"📢 尚未行动: {', '.join(missing_players)}"
                     )
             
-            collector.start_reminder_task(on_reminder)
+            collector.start_round_timer(on_timeout, on_reminder)
         
         else:
             # 后续行动
@@ -418,8 +500,7 @@ class TRPGMessageHandler(BaseEventHandler):
             )
         
         # 检查是否所有人都已行动
-        process_when_all_ready = multiplayer_config.get("process_when_all_ready", True)
-        if all_ready and process_when_all_ready:
+        if all_ready and _process_when_all_ready:
             logger.info(f"[TRPGHandler] 多人模式：所有 {total_count} 名玩家已行动，立即处理")
             collector.cancel_all_tasks()
             await self._process_collected_actions(stream_id, timeout=False)
@@ -439,7 +520,7 @@ class TRPGMessageHandler(BaseEventHandler):
         collector.mark_processing()
         collector.cancel_all_tasks()
         
-        actions = await collector.get_and_clear()
+        actions = collector.get_and_clear()
         
         if not actions:
             return
@@ -450,7 +531,7 @@ class TRPGMessageHandler(BaseEventHandler):
         
         # 获取未行动的玩家信息
         all_players = await _storage.get_players_in_session(stream_id)
-        acted_ids = {act["user_id"] for act in actions}
+        acted_ids = {act.user_id for act in actions}
         missing_players = [p for p in all_players if p.user_id not in acted_ids]
         
         # 发送处理开始提示
@@ -472,9 +553,9 @@ class TRPGMessageHandler(BaseEventHandler):
         if len(actions) == 1:
             # 只有一个行动，使用单人模式处理
             act = actions[0]
-            player = await _storage.get_player(stream_id, act["user_id"])
+            player = await _storage.get_player(stream_id, act.user_id)
             await self._generate_and_send_dm_response(
-                stream_id, session, act["action"], player
+                stream_id, session, act.action, player
             )
         else:
             # 多个行动，生成批量响应
@@ -484,14 +565,10 @@ class TRPGMessageHandler(BaseEventHandler):
         self, stream_id: str, session, player_message: str, player
     ):
         """生成并发送单人 DM 响应（带重试）"""
-        dm_config = _plugin_config.get("dm", {})
-        max_retries = dm_config.get("max_retries", DEFAULT_MAX_RETRIES)
-        retry_delay = dm_config.get("retry_delay", DEFAULT_RETRY_DELAY)
-        
         response = None
         last_error = None
         
-        for attempt in range(max_retries):
+        for attempt in range(_max_retries):
             try:
                 response = await _dm_engine.generate_dm_response(
                     session=session,
@@ -503,9 +580,9 @@ class TRPGMessageHandler(BaseEventHandler):
                     break
             except Exception as e:
                 last_error = e
-                logger.warning(f"[TRPGHandler] DM 响应生成失败 (尝试 {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(retry_delay * (2 ** attempt))
+                logger.warning(f"[TRPGHandler] DM 响应生成失败 (尝试 {attempt + 1}/{_max_retries}): {e}")
+                if attempt < _max_retries - 1:
+                    await asyncio.sleep(_retry_delay * (2 ** attempt))
         
         if response:
             # 解析状态变化
@@ -531,7 +608,7 @@ class TRPGMessageHandler(BaseEventHandler):
             if await _dm_engine.should_update_summary(session):
                 await _dm_engine.update_story_summary(session)
             
-            await _storage.save_session(session)
+            _storage.schedule_save(session)
             
             # 发送响应（如果有状态变化，附加变化摘要）
             if change_summary:
@@ -542,21 +619,15 @@ class TRPGMessageHandler(BaseEventHandler):
             # 检测高潮场景，自动生成图片
             await self._check_and_generate_climax_image(stream_id, session, clean_response)
         else:
-            logger.error(f"[TRPGHandler] DM 响应生成失败，已重试 {max_retries} 次: {last_error}")
+            logger.error(f"[TRPGHandler] DM 响应生成失败，已重试 {_max_retries} 次: {last_error}")
             await self.send_text(stream_id, "⚠️ DM 思考中遇到了问题，请稍后再试...")
 
     async def _check_and_generate_climax_image(
         self, stream_id: str, session, dm_response: str
     ):
         """检测高潮场景并自动生成图片"""
-        image_config = _plugin_config.get("image", {})
-        
-        # 检查是否启用图片生成
-        if not image_config.get("enabled", False):
-            return
-        
-        # 检查是否启用高潮自动画图
-        if not image_config.get("climax_auto_image", True):
+        # 检查是否启用图片生成及高潮自动画图
+        if not _climax_auto_image:
             return
         
         # 检测是否是高潮场景
@@ -566,8 +637,8 @@ class TRPGMessageHandler(BaseEventHandler):
         logger.info("[TRPGHandler] 检测到剧情高潮，自动生成场景图片")
         
         try:
-            from ..services.image_generator import ImageGenerator
-            generator = ImageGenerator(_plugin_config)
+            from ..services.image_generator import get_image_generator
+            generator = get_image_generator(_plugin_config)
             
             if not generator.is_enabled():
                 return
@@ -583,7 +654,7 @@ class TRPGMessageHandler(BaseEventHandler):
                 # 更新上次生成图片的历史索引
                 session.story_context.last_image_history_index = len(session.history)
                 session.story_context.add_key_event(f"[场景图片] {session.world_state.location}")
-                await _storage.save_session(session)
+                _storage.schedule_save(session)
                 logger.info("[TRPGHandler] 高潮场景图片生成成功")
             else:
                 logger.warning(f"[TRPGHandler] 高潮场景图片生成失败: {result}")
@@ -592,17 +663,13 @@ class TRPGMessageHandler(BaseEventHandler):
             logger.error(f"[TRPGHandler] 自动生成图片失败: {e}")
 
     async def _generate_batch_dm_response(
-        self, stream_id: str, session, actions: List[Dict]
+        self, stream_id: str, session, actions: List[ActionRecord]
     ):
         """生成多人行动的批量 DM 响应"""
-        dm_config = _plugin_config.get("dm", {})
-        max_retries = dm_config.get("max_retries", DEFAULT_MAX_RETRIES)
-        retry_delay = dm_config.get("retry_delay", DEFAULT_RETRY_DELAY)
-        
         # 构建多人行动描述
         action_lines = []
         for act in actions:
-            action_lines.append(f"【{act['character_name']}】{act['action']}")
+            action_lines.append(f"【{act.character_name}】{act.action}")
         
         combined_message = "\n".join(action_lines)
         
@@ -612,7 +679,7 @@ class TRPGMessageHandler(BaseEventHandler):
         response = None
         last_error = None
         
-        for attempt in range(max_retries):
+        for attempt in range(_max_retries):
             try:
                 response = await _dm_engine.generate_batch_dm_response(
                     session=session,
@@ -623,9 +690,9 @@ class TRPGMessageHandler(BaseEventHandler):
                     break
             except Exception as e:
                 last_error = e
-                logger.warning(f"[TRPGHandler] 批量 DM 响应生成失败 (尝试 {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(retry_delay * (2 ** attempt))
+                logger.warning(f"[TRPGHandler] 批量 DM 响应生成失败 (尝试 {attempt + 1}/{_max_retries}): {e}")
+                if attempt < _max_retries - 1:
+                    await asyncio.sleep(_retry_delay * (2 ** attempt))
         
         if response:
             # 解析并应用状态变化（多人回合应使用 uid 标签）
@@ -648,7 +715,7 @@ class TRPGMessageHandler(BaseEventHandler):
             if await _dm_engine.should_update_summary(session):
                 await _dm_engine.update_story_summary(session)
             
-            await _storage.save_session(session)
+            _storage.schedule_save(session)
             
             # 发送响应（如果有状态变化，附加变化摘要）
             if change_summary:
@@ -664,54 +731,21 @@ class TRPGMessageHandler(BaseEventHandler):
 
     def _generate_action_acknowledgment(self, text: str, character_name: str) -> str:
         """生成动作确认反馈，包含检定提示"""
-        text_lower = text.lower()
-        
-        # 检查动作格式（角色扮演格式）
-        if text.startswith("*") and text.endswith("*"):
+        # 检查动作格式（角色扮演格式），保留原有的包裹符号
+        if _ACTION_WRAP_RE.fullmatch(text):
             action = text[1:-1].strip()
             check_hint = self._get_check_hint(action)
-            return f"🎭 {character_name}: *{action}*{check_hint}"
-        
-        if text.startswith("（") and text.endswith("）"):
-            action = text[1:-1].strip()
-            check_hint = self._get_check_hint(action)
-            return f"🎭 {character_name}: （{action}）{check_hint}"
-        
-        if text.startswith("(") and text.endswith(")"):
-            action = text[1:-1].strip()
-            check_hint = self._get_check_hint(action)
-            return f"🎭 {character_name}: ({action}){check_hint}"
+            return f"🎭 {character_name}: {text[0]}{action}{text[-1]}{check_hint}"
         
         # 需要检定的动作类型（带检定提示）
-        check_actions = {
-            ("搜索", "调查", "检查", "查看", "观察", "寻找", "翻找"): ("🔍", "感知检定", "d20"),
-            ("攻击", "战斗", "打", "砍", "刺"): ("⚔️", "攻击检定", "d20"),
-            ("说服", "劝说", "欺骗", "撒谎", "威胁", "恐吓"): ("💬", "魅力检定", "d20"),
-            ("跳", "爬", "翻", "躲", "闪", "滚"): ("🤸", "敏捷检定", "d20"),
-            ("推", "拉", "举", "砸", "破门", "撞"): ("💪", "力量检定", "d20"),
-            ("回忆", "分析", "推理", "识破", "辨认"): ("🧠", "智力检定", "d20"),
-            ("潜行", "隐藏", "躲藏", "偷偷", "悄悄"): ("🫥", "隐匿检定", "d20"),
-            ("开锁", "撬", "拆", "修理", "解除"): ("🔧", "巧手检定", "d20"),
-        }
-        
-        for keywords, (emoji, check_name, dice) in check_actions.items():
-            if any(kw in text_lower for kw in keywords):
+        for pattern, (emoji, check_name, dice) in _ACK_CHECK_ACTIONS:
+            if pattern.search(text):
                 short_action = text[:25] + ("..." if len(text) > 25 else "")
                 return f"{emoji} {character_name} 尝试: {short_action}\n🎲 需要{check_name} `/r {dice}`"
         
         # 不需要检定的简单动作
-        simple_actions = {
-            ("打开", "开门"): "🚪",
-            ("拿", "捡", "获取"): "🤲",
-            ("走向", "前往", "进入", "离开", "移动"): "🚶",
-            ("使用"): "✨",
-            ("逃跑", "逃"): "🏃",
-            ("施法", "魔法"): "🪄",
-            ("说", "问", "告诉", "询问", "回答", "对话"): "💬",
-        }
-        
-        for keywords, emoji in simple_actions.items():
-            if any(kw in text_lower for kw in keywords):
+        for pattern, emoji in _ACK_SIMPLE_ACTIONS:
+            if pattern.search(text):
                 short_action = text[:30] + ("..." if len(text) > 30 else "")
                 return f"{emoji} {character_name}: {short_action}"
         
@@ -721,66 +755,26 @@ class TRPGMessageHandler(BaseEventHandler):
 
     def _get_check_hint(self, action: str) -> str:
         """根据动作内容返回检定提示"""
-        action_lower = action.lower()
-        
-        check_mappings = [
-            (["搜索", "调查", "检查", "查看", "观察", "寻找"], "感知检定", "d20"),
-            (["攻击", "战斗", "打", "砍", "刺"], "攻击检定", "d20"),
-            (["说服", "劝说", "欺骗", "威胁"], "魅力检定", "d20"),
-            (["跳", "爬", "翻", "躲", "闪"], "敏捷检定", "d20"),
-            (["推", "拉", "举", "砸", "破"], "力量检定", "d20"),
-            (["回忆", "分析", "推理", "识破"], "智力检定", "d20"),
-            (["潜行", "隐藏", "躲藏", "偷偷"], "隐匿检定", "d20"),
-            (["开锁", "撬", "拆", "修理"], "巧手检定", "d20"),
-        ]
-        
-        for keywords, check_name, dice in check_mappings:
-            if any(kw in action_lower for kw in keywords):
+        for pattern, (check_name, dice) in _CHECK_HINTS:
+            if pattern.search(action):
                 return f"\n🎲 需要{check_name} `/r {dice}`"
         
         return ""
 
     def _is_roleplay_message(self, text: str) -> bool:
-        """判断是否是角色扮演消息"""
-        # 动作描述格式
-        if text.startswith("*") and text.endswith("*"):
-            return True
-        if text.startswith("（") and text.endswith("）"):
-            return True
-        if text.startswith("(") and text.endswith(")"):
-            return True
-        
-        # 角色对话格式
-        if text.startswith("【") and "】" in text:
-            return True
-        
-        # 引号对话
-        if (text.startswith('"') and text.endswith('"')) or (text.startswith("“") and text.endswith("”")):
-            return True
-        
-        return False
+        """判断是否是角色扮演消息（动作描述、角色对话、引号对话）"""
+        return _ROLEPLAY_RE.match(text) is not None
 
     def _should_dm_respond(self, text: str, session) -> bool:
         """判断 DM 是否应该响应这条消息"""
-        # 行动关键词
-        action_keywords = [
-            "我要", "我想", "我尝试", "我试着", "我决定",
-            "攻击", "使用", "查看", "检查", "调查", "搜索",
-            "走向", "前往", "进入", "离开", "移动",
-            "说", "问", "告诉", "询问", "回答",
-            "拿", "捡", "打开", "关闭", "推", "拉",
-            "躲", "藏", "逃跑", "战斗", "施法",
-        ]
-        
-        text_lower = text.lower()
-        for keyword in action_keywords:
-            if keyword in text_lower:
-                return True
+        # 行动关键词（均为中文，无需大小写归一化）
+        if _DM_ACTION_KEYWORD_RE.search(text):
+            return True
         
         # 检查是否是对 NPC 说话
-        for npc_name in session.npcs.keys():
-            if npc_name in text:
-                return True
+        npc_pattern = session.npc_name_pattern()
+        if npc_pattern and npc_pattern.search(text):
+            return True
         
         # 检查消息长度（较长的消息可能是角色扮演）
         if len(text) > 20:
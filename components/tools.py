@@ -5,6 +5,7 @@ TRPG DM 插件 LLM 工具
 from typing import Any, Dict, Optional, TYPE_CHECKING
 from src.plugin_system import BaseTool, ToolParamType
 from src.common.logger import get_logger
+from ..services.dice import DiceExpressionError
 
 if TYPE_CHECKING:
     from ..models.storage import StorageManager
@@ -40,7 +41,8 @@ class RollDiceTool(BaseTool):
         if not _dice_service:
             return {"name": self.name, "content": "骰子服务未初始化"}
         
-        expression = function_args.get("expression", "d20")
+        # 参数来自 LLM，可能不是字符串（如整数 20），统一转换后再交给骰子服务
+        expression = str(function_args.get("expression", "d20"))
         reason = function_args.get("reason", "")
         
         try:
@@ -71,7 +73,7 @@ class RollDiceTool(BaseTool):
                 }
             }
             
-        except Exception as e:
+        except DiceExpressionError as e:
             return {"name": self.name, "content": f"掷骰失败: {str(e)}"}
 
 
@@ -187,7 +189,7 @@ class ModifyPlayerStatusTool(BaseTool):
             changes.append(f"MP: {old_mp} → {new_mp}")
         
         if changes:
-            await _storage.save_player(player)
+            _storage.schedule_player_save(player)
             return {
                 "name": self.name,
                 "content": f"已修改 {player.character_name} 的状态:\n" + "\n".join(changes),
@@ -223,7 +225,7 @@ class SearchLoreTool(BaseTool):
         if results:
             return {
                 "name": self.name,
-                "content": f"找到 {len(results)} 条相关设定:\n" + "\n".join([f"• {r}" for r in results[:5]]),
+                "content": "\n".join([f"找到 {len(results)} 条相关设定:", *(f"• {r}" for r in results[:5])]),
                 "data": {"results": results},
             }
         
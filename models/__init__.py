@@ -2,7 +2,7 @@
 TRPG DM 插件数据模型
 """
 
-from .session import TRPGSession, WorldState, NPCState, HistoryEntry
+from .session import TRPGSession, WorldState, NPCState, HistoryEntry, ActionRecord
 from .player import Player, PlayerAttributes, InventoryItem
 from .storage import StorageManager
 
@@ -11,6 +11,7 @@ __all__ = [
     "WorldState", 
     "NPCState",
     "HistoryEntry",
+    "ActionRecord",
     "Player",
     "PlayerAttributes",
     "InventoryItem",
@@ -79,12 +79,10 @@ class PlayerAttributes:
     def set_attribute(self, attr_name: str, value: int) -> bool:
         """设置属性值，支持简写"""
         attr_name = attr_name.lower()
-        if attr_name in self.ATTR_ALIASES:
-            attr_name = self.ATTR_ALIASES[attr_name]
-        if hasattr(self, attr_name):
-            setattr(self, attr_name, value)
-            return True
-        return False
+        if attr_name not in ATTRIBUTE_NAMES:
+            return False
+        setattr(self, self.ATTR_ALIASES.get(attr_name, attr_name), value)
+        return True
 
     def get_display(self) -> str:
         """获取属性显示文本"""
@@ -98,6 +96,10 @@ class PlayerAttributes:
         )
 
 
+# 所有可识别的属性名（标准名及简写/中文别名，均为小写）
+ATTRIBUTE_NAMES = frozenset(PlayerAttributes.ATTR_ALIASES) | frozenset(PlayerAttributes.ATTR_ALIASES.values())
+
+
 # 默认配置
 DEFAULT_FREE_POINTS = 30  # 初始自由加点点数
 DEFAULT_BASE_ATTRIBUTE = 8  # 基础属性值（加点前）
@@ -305,12 +307,9 @@ class Player:
         
         # 标准化属性名
         attr_name_lower = attr_name.lower()
-        if attr_name_lower in PlayerAttributes.ATTR_ALIASES:
-            std_attr = PlayerAttributes.ATTR_ALIASES[attr_name_lower]
-        elif hasattr(self.attributes, attr_name_lower):
-            std_attr = attr_name_lower
-        else:
+        if attr_name_lower not in ATTRIBUTE_NAMES:
             return False, f"未知属性: {attr_name}"
+        std_attr = PlayerAttributes.ATTR_ALIASES.get(attr_name_lower, attr_name_lower)
         
         # 检查点数是否足够
         if points > 0 and points > self.free_points:
@@ -387,9 +386,9 @@ class Player:
         status = "🔒 已锁定" if self.character_locked else f"🎯 剩余 {self.free_points} 点"
         
         if self.points_allocated:
-            allocated_str = ", ".join([
+            allocated_str = ", ".join(
                 f"{attr[:3].upper()}+{pts}" for attr, pts in self.points_allocated.items() if pts > 0
-            ])
+            )
             if allocated_str:
                 status += f"\n📊 已分配: {allocated_str}"
         
@@ -5,6 +5,7 @@
 from dataclasses import dataclass, field
 from typing import Dict, List, Optional, Any
 from enum import Enum
+import re
 import time
 
 
@@ -83,6 +84,18 @@ class HistoryEntry:
         return cls(**data)
 
 
+@dataclass
+class ActionRecord:
+    """多人模式下一名玩家在本轮提交的行动（仅在内存中收集，不持久化）"""
+    # 手写 __slots__（字段均无默认值），不依赖 Python 3.10 的 dataclass(slots=True)
+    __slots__ = ("user_id", "character_name", "action", "timestamp")
+
+    user_id: str
+    character_name: str
+    action: str
+    timestamp: float
+
+
 @dataclass
 class WorldState:
     """世界状态"""
@@ -212,6 +225,9 @@ class TRPGSession:
     player_ids: List[str] = field(default_factory=list)
     # 新增：剧情上下文
     story_context: StoryContext = field(default_factory=StoryContext)
+    # NPC 名称匹配正则缓存（不参与序列化），按 NPC 数量判断是否过期
+    _npc_pattern: Optional[re.Pattern] = field(default=None, init=False, repr=False, compare=False)
+    _npc_pattern_size: int = field(default=-1, init=False, repr=False, compare=False)
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -270,9 +286,23 @@ class TRPGSession:
         """添加 NPC"""
         npc = NPCState(name=name, **kwargs)
         self.npcs[name] = npc
+        self._npc_pattern_size = -1
         self.updated_at = time.time()
         return npc
 
+    def npc_name_pattern(self) -> Optional[re.Pattern]:
+        """
+        获取匹配任一 NPC 名称的正则，没有 NPC 时返回 None
+
+        NPC 只增不减，模组加载时也会直接写入 npcs，因此以数量变化作为重建依据。
+        """
+        if self._npc_pattern_size != len(self.npcs):
+            self._npc_pattern = (
+                re.compile("|".join(map(re.escape, self.npcs))) if self.npcs else None
+            )
+            self._npc_pattern_size = len(self.npcs)
+        return self._npc_pattern
+
     def add_player(self, user_id: str):
         """添加玩家到会话"""
         if user_id not in self.player_ids:
@@ -5,13 +5,52 @@
 import json
 import asyncio
 from pathlib import Path
-from typing import Dict, Optional, List, Any, Tuple
+from typing import Dict, Optional, List, Any, Tuple, Iterator
 from src.common.logger import get_logger
-from .session import TRPGSession
+from .session import TRPGSession, HistoryEntry
 from .player import Player
 
+try:
+    import orjson  # 可选依赖：安装后用于加速序列化
+except ImportError:
+    orjson = None
+
 logger = get_logger("trpg_storage")
 
+# 延迟保存的合并窗口（秒）：窗口内对同一会话/玩家的多次修改只写盘一次
+SAVE_DEBOUNCE_DELAY = 0.1
+
+
+def _dump_json(data: Any) -> bytes:
+    """序列化为 UTF-8 编码的 JSON（安装了 orjson 时使用 orjson，输出格式一致）"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def _dump_json_line(data: Any) -> bytes:
+    """序列化为单行 JSON（JSON Lines 格式，带换行符）"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def _write_bytes_file(path: Path, content: bytes, mode: str = "wb"):
+    """写入文件（阻塞调用，由 asyncio.to_thread 放到工作线程执行）"""
+    with open(path, mode) as f:
+        f.write(content)
+
+
+async def _write_json_file(path: Path, data: Any):
+    """
+    写入 JSON 文件
+
+    序列化在事件循环线程完成，保证写出的是调用时刻的一致快照；
+    只有阻塞的文件写入交给工作线程。
+    """
+    content = _dump_json(data)
+    await asyncio.to_thread(_write_bytes_file, path, content)
+
 
 class StorageManager:
     """数据存储管理器 - 负责所有数据的持久化"""
@@ -23,35 +62,45 @@ class StorageManager:
         self.lore_dir = self.data_dir / "lore"
         self.config_dir = self.data_dir / "config"
         self.slots_dir = self.data_dir / "save_slots"
+        self.history_archive_dir = self.data_dir / "history_archive"
         
         # 配置
         self._config = config or {}
         self._max_slots = self._config.get("save_slots", {}).get("max_slots", 3)
-        self._allowed_groups = self._config.get("plugin", {}).get("allowed_groups", [])
+        self._allowed_groups = frozenset(self._config.get("plugin", {}).get("allowed_groups", []))
         
         # 内存缓存
+        # 这些字典只在事件循环线程内以单条语句读写，中间没有 await，无需加锁；
+        # 文件写入由锁串行化：会话/玩家文件按 stream_id 分锁，其余共用 self._lock
         self._sessions: Dict[str, TRPGSession] = {}
         self._players: Dict[str, Dict[str, Player]] = {}
         self._enabled_groups: List[str] = []
+        self._enabled_group_set: frozenset = frozenset()  # _enabled_groups 的只读快照，供逐条消息判定
         self._pending_joins: Dict[str, Dict[str, str]] = {}  # {stream_id: {user_id: character_name}}
         
+        # 延迟保存
+        self._dirty_sessions: Dict[str, TRPGSession] = {}
+        self._dirty_players: Dict[str, Dict[str, Player]] = {}  # {stream_id: {user_id: Player}}
+        self._pending_saves: Dict[str, asyncio.Task] = {}
+        
         # 确保目录存在
         self._ensure_directories()
         
         # 文件锁
         self._lock = asyncio.Lock()
+        self._stream_locks: Dict[str, asyncio.Lock] = {}
 
     def _ensure_directories(self):
         """确保所有必要的目录存在"""
         for directory in [self.sessions_dir, self.players_dir, self.lore_dir, 
-                          self.config_dir, self.slots_dir]:
+                          self.config_dir, self.slots_dir, self.history_archive_dir]:
             directory.mkdir(parents=True, exist_ok=True)
 
     def update_config(self, config: Dict[str, Any]):
         """更新配置"""
         self._config = config
         self._max_slots = config.get("save_slots", {}).get("max_slots", 3)
-        self._allowed_groups = config.get("plugin", {}).get("allowed_groups", [])
+        self._allowed_groups = frozenset(config.get("plugin", {}).get("allowed_groups", []))
 
     async def initialize(self):
         """初始化存储管理器，加载所有数据"""
@@ -69,12 +118,15 @@ class StorageManager:
                     self._enabled_groups = json.load(f)
             except Exception:
                 self._enabled_groups = []
+        self._enabled_group_set = frozenset(self._enabled_groups)
 
     async def _save_enabled_groups(self):
-        """保存启用的群组列表"""
+        """保存启用的群组列表（同时刷新内存快照）"""
+        self._enabled_group_set = frozenset(self._enabled_groups)
         config_file = self.config_dir / "enabled_groups.json"
-        with open(config_file, "w", encoding="utf-8") as f:
-            json.dump(self._enabled_groups, f, ensure_ascii=False, indent=2)
+        # 写入在工作线程中进行，加锁避免两次写入同时截断/写同一文件
+        async with self._lock:
+            await _write_json_file(config_file, self._enabled_groups)
 
     async def _load_all_sessions(self):
         """加载所有会话"""
@@ -120,20 +172,20 @@ class StorageManager:
 
     def is_group_enabled(self, stream_id: str) -> bool:
         """检查群组是否启用跑团"""
-        return stream_id in self._enabled_groups
+        return stream_id in self._enabled_group_set
 
     async def enable_group(self, stream_id: str) -> bool:
         """启用群组"""
         if not self.is_group_allowed(stream_id):
             return False
-        if stream_id not in self._enabled_groups:
+        if stream_id not in self._enabled_group_set:
             self._enabled_groups.append(stream_id)
             await self._save_enabled_groups()
         return True
 
     async def disable_group(self, stream_id: str):
         """禁用群组"""
-        if stream_id in self._enabled_groups:
+        if stream_id in self._enabled_group_set:
             self._enabled_groups.remove(stream_id)
             await self._save_enabled_groups()
 
@@ -158,15 +210,91 @@ class StorageManager:
         
         return session
 
+    def _get_stream_lock(self, stream_id: str) -> asyncio.Lock:
+        """
+        获取会话的写盘锁
+
+        同一会话的写入按调用顺序串行（asyncio.Lock 先到先得），
+        不同会话的写入互不等待，可在工作线程中并行落盘。
+        """
+        lock = self._stream_locks.get(stream_id)
+        if lock is None:
+            lock = self._stream_locks[stream_id] = asyncio.Lock()
+        return lock
+
     async def save_session(self, session: TRPGSession):
         """保存会话"""
-        async with self._lock:
+        # 立即保存会覆盖窗口内尚未写出的修改
+        self._dirty_sessions.pop(session.stream_id, None)
+        async with self._get_stream_lock(session.stream_id):
             max_history = self._config.get("session", {}).get("max_history_length", 0)
-            if isinstance(max_history, int) and max_history > 0:
+            if isinstance(max_history, int) and 0 < max_history < len(session.history):
+                # 超出窗口的旧记录追加到归档文件，存档只保留最近 max_history 条
+                trimmed = session.history[:-max_history]
                 session.trim_history(max_history)
+                await self._archive_history(session.stream_id, trimmed)
             session_file = self.sessions_dir / f"{session.stream_id}.json"
-            with open(session_file, "w", encoding="utf-8") as f:
-                json.dump(session.to_dict(), f, ensure_ascii=False, indent=2)
+            await _write_json_file(session_file, session.to_dict())
+
+    async def _archive_history(self, stream_id: str, entries: List[HistoryEntry]):
+        """把修剪掉的历史记录追加到 history_archive/<stream_id>.jsonl"""
+        content = b"".join(_dump_json_line(entry.to_dict()) for entry in entries)
+        archive_file = self.history_archive_dir / f"{stream_id}.jsonl"
+        await asyncio.to_thread(_write_bytes_file, archive_file, content, "ab")
+
+    def schedule_save(self, session: TRPGSession):
+        """
+        延迟保存会话
+
+        在 SAVE_DEBOUNCE_DELAY 窗口内对同一会话的多次调用合并为一次写盘。
+        需要立即落盘的场景（结束会话、手动保存、存档）请使用 save_session。
+        """
+        stream_id = session.stream_id
+        self._dirty_sessions[stream_id] = session
+        self._ensure_flush_scheduled(stream_id)
+
+    def schedule_player_save(self, player: Player):
+        """
+        延迟保存玩家数据
+
+        与 schedule_save 共用所在会话的合并窗口，窗口结束时一并写出。
+        """
+        stream_id = player.stream_id
+        self._dirty_players.setdefault(stream_id, {})[player.user_id] = player
+        self._ensure_flush_scheduled(stream_id)
+
+    def _ensure_flush_scheduled(self, stream_id: str):
+        """确保该会话有一个等待中的延迟写盘任务"""
+        if stream_id not in self._pending_saves:
+            self._pending_saves[stream_id] = asyncio.create_task(self._flush_after(stream_id))
+
+    async def _flush_after(self, stream_id: str):
+        """等待合并窗口结束后写出会话及玩家数据"""
+        await asyncio.sleep(SAVE_DEBOUNCE_DELAY)
+        self._pending_saves.pop(stream_id, None)
+        try:
+            await self._write_dirty(stream_id)
+        except Exception as e:
+            logger.error(f"[Storage] 延迟保存失败 {stream_id}: {e}")
+
+    async def _write_dirty(self, stream_id: str):
+        """写出某个会话下所有待保存的数据"""
+        session = self._dirty_sessions.pop(stream_id, None)
+        players = self._dirty_players.pop(stream_id, None)
+        if session:
+            await self.save_session(session)
+        if players:
+            for player in players.values():
+                await self.save_player(player)
+
+    async def flush_pending(self, stream_id: Optional[str] = None):
+        """立即写出待保存的会话及玩家数据（不指定 stream_id 时写出全部）"""
+        stream_ids = [stream_id] if stream_id else list(self._pending_saves)
+        for sid in stream_ids:
+            task = self._pending_saves.pop(sid, None)
+            if task and not task.done():
+                task.cancel()
+            await self._write_dirty(sid)
 
     async def end_session(self, stream_id: str) -> bool:
         """结束会话"""
@@ -197,31 +325,72 @@ class StorageManager:
         slot_dir.mkdir(parents=True, exist_ok=True)
         return slot_dir
 
+    def _load_slot_index(self, slot_dir: Path) -> Dict[str, Dict[str, Any]]:
+        """读取存档摘要索引 {插槽号: {world_name, created_at, player_count}}"""
+        index_file = slot_dir / "index.json"
+        if not index_file.exists():
+            return {}
+        try:
+            with open(index_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    async def _write_slot_index(self, slot_dir: Path, index: Dict[str, Dict[str, Any]]):
+        """写入存档摘要索引"""
+        await _write_json_file(slot_dir / "index.json", index)
+
     async def list_save_slots(self, stream_id: str) -> List[Dict[str, Any]]:
-        """列出群组的所有存档插槽"""
+        """
+        列出群组的所有存档插槽
+
+        只读取摘要索引，不再逐个解析完整存档；旧版本留下的、索引中缺失的存档
+        会回退读取一次并补写索引。
+        """
         slot_dir = self._get_slot_dir(stream_id)
+        index = self._load_slot_index(slot_dir)
+        existing = {p.name for p in slot_dir.glob("slot_*.json")}
+        backfilled: Dict[str, Dict[str, Any]] = {}
         slots = []
         
         for i in range(1, self._max_slots + 1):
-            slot_file = slot_dir / f"slot_{i}.json"
-            if slot_file.exists():
+            if f"slot_{i}.json" not in existing:
+                slots.append({"slot": i, "exists": False})
+                continue
+            
+            summary = index.get(str(i))
+            if summary is None:
                 try:
-                    with open(slot_file, "r", encoding="utf-8") as f:
+                    with open(slot_dir / f"slot_{i}.json", "r", encoding="utf-8") as f:
                         data = json.load(f)
-                    slots.append({
-                        "slot": i,
-                        "world_name": data.get("session", {}).get("world_name", "未知"),
-                        "created_at": data.get("saved_at", "未知"),
-                        "player_count": len(data.get("players", [])),
-                        "exists": True,
-                    })
+                    summary = self._make_slot_summary(data)
+                    backfilled[str(i)] = summary
                 except Exception:
                     slots.append({"slot": i, "exists": False, "error": True})
-            else:
-                slots.append({"slot": i, "exists": False})
+                    continue
+            
+            slots.append({"slot": i, **summary, "exists": True})
+        
+        if backfilled:
+            async with self._lock:
+                # 在锁内重新读取索引再合并：期间完成的存档/删除不能被这里的旧快照覆盖
+                index = self._load_slot_index(slot_dir)
+                for key, summary in backfilled.items():
+                    if key not in index and (slot_dir / f"slot_{key}.json").exists():
+                        index[key] = summary
+                await self._write_slot_index(slot_dir, index)
         
         return slots
 
+    @staticmethod
+    def _make_slot_summary(save_data: Dict[str, Any]) -> Dict[str, Any]:
+        """从完整存档数据提取列表展示用的摘要"""
+        return {
+            "world_name": save_data.get("session", {}).get("world_name", "未知"),
+            "created_at": save_data.get("saved_at", "未知"),
+            "player_count": len(save_data.get("players", [])),
+        }
+
     async def save_to_slot(self, stream_id: str, slot_number: int) -> Tuple[bool, str]:
         """保存当前会话到指定插槽"""
         if slot_number < 1 or slot_number > self._max_slots:
@@ -254,8 +423,10 @@ class StorageManager:
         }
         
         async with self._lock:
-            with open(slot_file, "w", encoding="utf-8") as f:
-                json.dump(save_data, f, ensure_ascii=False, indent=2)
+            await _write_json_file(slot_file, save_data)
+            index = self._load_slot_index(slot_dir)
+            index[str(slot_number)] = self._make_slot_summary(save_data)
+            await self._write_slot_index(slot_dir, index)
         
         return True, f"已保存到插槽 {slot_number}"
 
@@ -286,7 +457,8 @@ class StorageManager:
             self._sessions[stream_id] = session
             await self.save_session(session)
             
-            # 恢复玩家
+            # 恢复玩家（丢弃旧玩家对象尚未写出的修改）
+            self._dirty_players.pop(stream_id, None)
             self._players[stream_id] = {}
             for player_data in save_data.get("players", []):
                 player_data["stream_id"] = stream_id
@@ -314,7 +486,11 @@ class StorageManager:
             return False, f"插槽 {slot_number} 没有存档"
         
         try:
-            slot_file.unlink()
+            async with self._lock:
+                slot_file.unlink()
+                index = self._load_slot_index(slot_dir)
+                if index.pop(str(slot_number), None) is not None:
+                    await self._write_slot_index(slot_dir, index)
             return True, f"已删除插槽 {slot_number} 的存档"
         except Exception as e:
             return False, f"删除失败: {e}"
@@ -343,6 +519,18 @@ class StorageManager:
         """获取群组所有待确认的加入请求"""
         return self._pending_joins.get(stream_id, {}).copy()
 
+    def has_pending_joins(self, stream_id: str) -> bool:
+        """检查群组是否有待确认的加入请求"""
+        return bool(self._pending_joins.get(stream_id))
+
+    def iter_pending_joins(self, stream_id: str) -> Iterator[Tuple[str, str]]:
+        """
+        遍历群组待确认的加入请求 (user_id, character_name)
+
+        不复制字典，调用方需在遍历过程中不 await、不修改请求列表。
+        """
+        return iter(self._pending_joins.get(stream_id, {}).items())
+
     # ==================== 玩家操作 ====================
 
     async def get_player(self, stream_id: str, user_id: str) -> Optional[Player]:
@@ -351,6 +539,13 @@ class StorageManager:
             return self._players[stream_id].get(user_id)
         return None
 
+    async def get_players_by_ids(self, stream_id: str, user_ids) -> Dict[str, Player]:
+        """批量获取玩家，返回 {user_id: Player}，不存在的 ID 会被跳过"""
+        stream_players = self._players.get(stream_id)
+        if not stream_players:
+            return {}
+        return {uid: stream_players[uid] for uid in user_ids if uid in stream_players}
+
     async def create_player(
         self, 
         stream_id: str, 
@@ -414,17 +609,20 @@ class StorageManager:
 
     async def save_player(self, player: Player):
         """保存玩家数据"""
-        async with self._lock:
+        # 立即保存会覆盖窗口内尚未写出的修改
+        self._dirty_players.get(player.stream_id, {}).pop(player.user_id, None)
+        async with self._get_stream_lock(player.stream_id):
             player_dir = self.players_dir / player.stream_id
             player_dir.mkdir(parents=True, exist_ok=True)
             player_file = player_dir / f"{player.user_id}.json"
-            with open(player_file, "w", encoding="utf-8") as f:
-                json.dump(player.to_dict(), f, ensure_ascii=False, indent=2)
+            await _write_json_file(player_file, player.to_dict())
 
     async def delete_player(self, stream_id: str, user_id: str) -> bool:
         """删除玩家"""
         if stream_id in self._players and user_id in self._players[stream_id]:
             del self._players[stream_id][user_id]
+            # 丢弃尚未写出的修改，避免延迟保存把文件重新写回来
+            self._dirty_players.get(stream_id, {}).pop(user_id, None)
             
             player_file = self.players_dir / stream_id / f"{user_id}.json"
             if player_file.exists():
@@ -446,17 +644,24 @@ class StorageManager:
 
     # ==================== 世界观设定 ====================
 
-    async def get_lore(self, stream_id: str) -> List[str]:
-        """获取世界观设定"""
+    async def get_lore(self, stream_id: str, limit: Optional[int] = None) -> List[str]:
+        """获取世界观设定（limit 指定时只返回前 limit 条）"""
         session = await self.get_session(stream_id)
-        return session.lore if session else []
+        if not session:
+            return []
+        return session.lore[:limit] if limit is not None else session.lore
+
+    async def count_lore(self, stream_id: str) -> int:
+        """获取世界观设定条数"""
+        session = await self.get_session(stream_id)
+        return len(session.lore) if session else 0
 
     async def add_lore(self, stream_id: str, lore_entry: str) -> bool:
         """添加世界观设定"""
         session = await self.get_session(stream_id)
         if session:
             session.lore.append(lore_entry)
-            await self.save_session(session)
+            self.schedule_save(session)
             return True
         return False
 
@@ -469,6 +674,7 @@ class StorageManager:
 
     async def save_all(self):
         """保存所有数据"""
+        await self.flush_pending()
         for session in self._sessions.values():
             await self.save_session(session)
         
@@ -4,8 +4,9 @@
 
 import json
 import re
+import time
 from pathlib import Path
-from typing import Optional, List, Dict, Any, TYPE_CHECKING
+from typing import Optional, List, Dict, Any, Tuple, TYPE_CHECKING
 
 from src.common.logger import get_logger
 from .base import ModuleBase, ModuleInfo
@@ -17,6 +18,9 @@ if TYPE_CHECKING:
 
 logger = get_logger("trpg_module_loader")
 
+# 模组列表复查间隔（秒）：间隔内直接返回缓存，不再 stat 模组目录
+MODULE_LIST_TTL = 30.0
+
 
 class ModuleLoader:
     """模组加载器 - 负责加载和应用模组"""
@@ -35,6 +39,12 @@ class ModuleLoader:
         self.custom_modules_dir = plugin_root / configured_markdown_dir
         self.custom_modules_dir.mkdir(parents=True, exist_ok=True)
 
+        # 已解析模组缓存: {module_id: (源文件 mtime_ns, 模组)}，预设模组 mtime 记为 0
+        self._module_cache: Dict[str, Tuple[int, ModuleBase]] = {}
+        # 模组列表缓存: (JSON 模组文件签名 ((文件名, mtime_ns), ...), 模组列表)
+        self._module_list_cache: Optional[Tuple[tuple, List[Dict[str, Any]]]] = None
+        self._module_list_checked_at = 0.0
+
         # 扫描并导入 Markdown 模组
         self.auto_scan_markdown = module_config.get("auto_scan_markdown", True)
         if self.auto_scan_markdown:
@@ -88,16 +98,43 @@ class ModuleLoader:
         """刷新模组列表，重新扫描 Markdown 模组"""
         if self.auto_scan_markdown:
             self._scan_markdown_modules()
+        self._invalidate_module_list()
+
+    def _invalidate_module_list(self):
+        """让下一次 list_available_modules 立即复查模组目录"""
+        self._module_list_checked_at = 0.0
 
     def list_available_modules(self) -> List[Dict[str, Any]]:
-        """列出所有可用的模组"""
+        """
+        列出所有可用的模组
+
+        MODULE_LIST_TTL 内直接返回缓存；超时后只 stat 模组目录下的 JSON 文件，
+        文件增删或修改时才重新解析。返回的列表在多次调用间共享，调用方不应修改它。
+        """
+        now = time.monotonic()
+        if self._module_list_cache and now - self._module_list_checked_at < MODULE_LIST_TTL:
+            return self._module_list_cache[1]
+        self._module_list_checked_at = now
+        
+        module_files = []
+        for module_file in self.modules_dir.glob("*.json"):
+            try:
+                module_files.append((module_file, module_file.stat().st_mtime_ns))
+            except OSError:
+                continue
+        module_files.sort()
+        signature = tuple((f.name, mtime_ns) for f, mtime_ns in module_files)
+        
+        if self._module_list_cache and self._module_list_cache[0] == signature:
+            return self._module_list_cache[1]
+        
         modules = []
         
         # 添加预设模组
         modules.extend(get_module_list())
         
         # 添加自定义模组（JSON）
-        for module_file in self.modules_dir.glob("*.json"):
+        for module_file, _ in module_files:
             try:
                 with open(module_file, "r", encoding="utf-8") as f:
                     data = json.load(f)
@@ -113,20 +150,41 @@ class ModuleLoader:
             except Exception:
                 continue
         
+        self._module_list_cache = (signature, modules)
         return modules
 
     def load_module(self, module_id: str) -> Optional[ModuleBase]:
-        """加载指定的模组"""
+        """
+        加载指定的模组
+
+        解析结果按 (module_id, 文件 mtime) 缓存，返回的模组对象在多次调用间共享，
+        调用方不应修改它（apply_module_to_session 只做拷贝）。
+        """
         # 首先尝试加载预设模组
         if module_id in PRESET_MODULES:
-            return create_preset_module(module_id)
+            cached = self._module_cache.get(module_id)
+            if cached:
+                return cached[1]
+            module = create_preset_module(module_id)
+            self._module_cache[module_id] = (0, module)
+            return module
         
         # 尝试加载自定义模组
         module_file = self.modules_dir / f"{module_id}.json"
-        if module_file.exists():
-            return self._load_custom_module(module_file)
+        try:
+            mtime_ns = module_file.stat().st_mtime_ns
+        except OSError:
+            self._module_cache.pop(module_id, None)
+            return None
         
-        return None
+        cached = self._module_cache.get(module_id)
+        if cached and cached[0] == mtime_ns:
+            return cached[1]
+        
+        module = self._load_custom_module(module_file)
+        if module:
+            self._module_cache[module_id] = (mtime_ns, module)
+        return module
 
     def _load_custom_module(self, file_path: Path) -> Optional[ModuleBase]:
         """从JSON文件加载自定义模组"""
@@ -177,6 +235,7 @@ class ModuleLoader:
             module_file = self.modules_dir / f"{module.info.id}.json"
             with open(module_file, "w", encoding="utf-8") as f:
                 json.dump(module.to_dict(), f, ensure_ascii=False, indent=2)
+            self._invalidate_module_list()
             return True
         except Exception as e:
             logger.error(f"保存模组失败: {e}")
@@ -2,19 +2,21 @@
 TRPG DM 插件服务模块
 """
 
-from .dice import DiceService, DiceResult
+from .dice import DiceService, DiceResult, DiceExpressionError
 from .dm_engine import DMEngine
 from .pdf_parser import PDFModuleParser, import_pdf_module
 from .markdown_parser import MarkdownModuleParser, import_markdown_module
-from .image_generator import ImageGenerator
+from .image_generator import ImageGenerator, get_image_generator
 
 __all__ = [
     "DiceService",
     "DiceResult",
+    "DiceExpressionError",
     "DMEngine",
     "PDFModuleParser",
     "import_pdf_module",
     "MarkdownModuleParser",
     "import_markdown_module",
     "ImageGenerator",
+    "get_image_generator",
 ]
@@ -7,6 +7,13 @@ import random
 from dataclasses import dataclass, field
 from typing import List, Tuple, Optional
 
+# 表达式长度上限，同时避免超长数字串在 int() 中触发位数限制
+MAX_EXPRESSION_LENGTH = 100
+
+
+class DiceExpressionError(ValueError):
+    """骰子表达式无效或超出限制"""
+
 
 @dataclass
 class DiceResult:
@@ -59,6 +66,12 @@ class DiceService:
         r'(\d*)d(\d+)|([+-]?\d+)',
         re.IGNORECASE
     )
+    
+    # 复杂表达式的逐项切分: 带符号的 XdY 或常数
+    TERM_PATTERN = re.compile(
+        r'([+-])(\d*d\d+|\d+)',
+        re.IGNORECASE
+    )
 
     def __init__(self, max_dice_count: int = 100, max_dice_sides: int = 1000):
         self.max_dice_count = max_dice_count
@@ -68,6 +81,8 @@ class DiceService:
         """
         掷骰子
         
+        表达式无效或超出限制时抛出 DiceExpressionError
+        
         支持的格式:
         - d20: 掷一个20面骰
         - 2d6: 掷两个6面骰
@@ -78,6 +93,8 @@ class DiceService:
         expression = (expression or "").strip().lower().replace(" ", "")
         if not expression:
             expression = "d20"
+        if len(expression) > MAX_EXPRESSION_LENGTH:
+            raise DiceExpressionError(f"骰子表达式过长（最多 {MAX_EXPRESSION_LENGTH} 个字符）")
         
         # 尝试简单表达式
         simple_match = self.DICE_PATTERN.match(expression)
@@ -97,15 +114,15 @@ class DiceService:
         
         # 基础校验
         if count < 1:
-            raise ValueError("骰子数量必须 >= 1")
+            raise DiceExpressionError("骰子数量必须 >= 1")
         if sides < 1:
-            raise ValueError("骰子面数必须 >= 1")
+            raise DiceExpressionError("骰子面数必须 >= 1")
 
         # 验证限制
         if count > self.max_dice_count:
-            raise ValueError(f"单次最大骰子数量为 {self.max_dice_count}")
+            raise DiceExpressionError(f"单次最大骰子数量为 {self.max_dice_count}")
         if sides > self.max_dice_sides:
-            raise ValueError(f"单个骰子最大面数为 {self.max_dice_sides}")
+            raise DiceExpressionError(f"单个骰子最大面数为 {self.max_dice_sides}")
         
         # 掷骰子
         rolls = [random.randint(1, sides) for _ in range(count)]
@@ -136,11 +153,10 @@ class DiceService:
         if expression and expression[0] not in '+-':
             expression = '+' + expression
         
-        token_re = re.compile(r'([+-])(\d*d\d+|\d+)', re.IGNORECASE)
         pos = 0
-        for m in token_re.finditer(expression):
+        for m in self.TERM_PATTERN.finditer(expression):
             if m.start() != pos:
-                raise ValueError(f"骰子表达式无效: {expression}")
+                raise DiceExpressionError(f"骰子表达式无效: {expression}")
             pos = m.end()
 
             sign = 1 if m.group(1) == "+" else -1
@@ -152,13 +168,13 @@ class DiceService:
                 sides = int(sides_str)
 
                 if count < 1:
-                    raise ValueError("骰子数量必须 >= 1")
+                    raise DiceExpressionError("骰子数量必须 >= 1")
                 if sides < 1:
-                    raise ValueError("骰子面数必须 >= 1")
+                    raise DiceExpressionError("骰子面数必须 >= 1")
                 if count > self.max_dice_count:
-                    raise ValueError(f"单次最大骰子数量为 {self.max_dice_count}")
+                    raise DiceExpressionError(f"单次最大骰子数量为 {self.max_dice_count}")
                 if sides > self.max_dice_sides:
-                    raise ValueError(f"单个骰子最大面数为 {self.max_dice_sides}")
+                    raise DiceExpressionError(f"单个骰子最大面数为 {self.max_dice_sides}")
 
                 rolls = [random.randint(1, sides) for _ in range(count)]
                 all_rolls.extend([r * sign for r in rolls])
@@ -169,7 +185,7 @@ class DiceService:
                 total += num * sign
 
         if pos != len(expression):
-            raise ValueError(f"骰子表达式无效: {expression}")
+            raise DiceExpressionError(f"骰子表达式无效: {expression}")
         
         return DiceResult(
             expression=expression.lstrip('+'),
@@ -10,7 +10,7 @@ from src.plugin_system.apis import llm_api
 from src.common.logger import get_logger
 
 if TYPE_CHECKING:
-    from ..models.session import TRPGSession, HistoryEntry
+    from ..models.session import TRPGSession, HistoryEntry, ActionRecord
     from ..models.player import Player
 
 logger = get_logger("trpg_dm_engine")
@@ -253,7 +253,7 @@ class DMEngine:
             player = await storage.get_player(session.stream_id, user_id)
             if player:
                 old_hp, new_hp = player.modify_hp(delta)
-                await storage.save_player(player)
+                storage.schedule_player_save(player)
                 sign = "+" if delta > 0 else ""
                 applied_changes.append(
                     f"❤️ {player.character_name} HP: {old_hp} → {new_hp} ({sign}{delta})"
@@ -265,7 +265,7 @@ class DMEngine:
             player = await storage.get_player(session.stream_id, user_id)
             if player:
                 old_mp, new_mp = player.modify_mp(delta)
-                await storage.save_player(player)
+                storage.schedule_player_save(player)
                 sign = "+" if delta > 0 else ""
                 applied_changes.append(
                     f"💙 {player.character_name} MP: {old_mp} → {new_mp} ({sign}{delta})"
@@ -285,7 +285,7 @@ class DMEngine:
                         f"📊 {player.character_name} {attr_name}: {old_val} → {new_val} ({sign}{delta})"
                     )
                     logger.info(f"[DMEngine] 应用属性变化: {player.character_name} {attr_name} {sign}{delta}")
-                await storage.save_player(player)
+                storage.schedule_player_save(player)
         
         # 应用物品获得
         for user_id, items in changes.item_gains.items():
@@ -297,7 +297,7 @@ class DMEngine:
                         f"🎒 {player.character_name} 获得: {item_name} x{qty}"
                     )
                     logger.info(f"[DMEngine] 物品获得: {player.character_name} +{item_name} x{qty}")
-                await storage.save_player(player)
+                storage.schedule_player_save(player)
         
         # 应用物品失去
         for user_id, items in changes.item_losses.items():
@@ -310,7 +310,7 @@ class DMEngine:
                             f"🎒 {player.character_name} 失去: {item_name} x{qty}"
                         )
                         logger.info(f"[DMEngine] 物品失去: {player.character_name} -{item_name} x{qty}")
-                await storage.save_player(player)
+                storage.schedule_player_save(player)
         
         # 应用世界状态变化
         if changes.world_changes.get("location"):
@@ -325,9 +325,9 @@ class DMEngine:
             session.world_state.time_of_day = changes.world_changes["time"]
             applied_changes.append(f"🕐 时间变化: {session.world_state.time_of_day}")
         
-        # 保存会话
+        # 保存会话（与本回合的其他修改合并为一次延迟写盘）
         if changes.world_changes:
-            await storage.save_session(session)
+            storage.schedule_save(session)
         
         return "\n".join(applied_changes) if applied_changes else ""
 
@@ -425,9 +425,9 @@ class DMEngine:
         if not recent_history:
             return
         
-        history_text = "\n".join([
+        history_text = "\n".join(
             f"[{h.entry_type}] {h.content[:100]}" for h in recent_history
-        ])
+        )
         
         prompt = f"""请根据以下跑团历史记录，生成一段简洁的剧情摘要（100字以内）：
 
@@ -557,7 +557,7 @@ class DMEngine:
     async def generate_batch_dm_response(
         self,
         session: "TRPGSession",
-        actions: List[Dict[str, Any]],
+        actions: List["ActionRecord"],
         config: Optional[Dict] = None,
     ) -> str:
         """
@@ -565,7 +565,7 @@ class DMEngine:
         
         Args:
             session: 跑团会话
-            actions: 行动列表 [{user_id, character_name, action, timestamp}]
+            actions: 本轮收集到的行动记录
             config: 配置
             
         Returns:
@@ -612,7 +612,7 @@ class DMEngine:
     def _build_batch_dm_prompt(
         self,
         session: "TRPGSession",
-        actions: List[Dict[str, Any]],
+        actions: List["ActionRecord"],
     ) -> str:
         """构建多人行动的 DM 提示词"""
         # 获取最近的历史记录
@@ -633,13 +633,13 @@ class DMEngine:
         # 构建行动列表
         action_lines = []
         for act in actions:
-            action_lines.append(f"• {act['character_name']}: {act['action']}")
+            action_lines.append(f"• {act.character_name}: {act.action}")
         actions_text = "\n".join(action_lines)
 
         # uid 映射（用于多人回合状态标签）
         uid_lines = []
         for act in actions:
-            uid_lines.append(f"- uid:{act['user_id']} = {act['character_name']}")
+            uid_lines.append(f"- uid:{act.user_id} = {act.character_name}")
         uid_map_text = "\n".join(uid_lines)
         
         # 世界状态
@@ -701,19 +701,19 @@ class DMEngine:
         return prompt
 
     def _format_batch_response(
-        self, response: str, session: "TRPGSession", actions: List[Dict]
+        self, response: str, session: "TRPGSession", actions: List["ActionRecord"]
     ) -> str:
         """格式化批量响应"""
         # 添加回合标记
-        player_names = [act["character_name"] for act in actions]
+        player_names = [act.character_name for act in actions]
         header = f"🎭 本轮行动结果 ({', '.join(player_names)})\n\n"
         return header + response
 
-    def _get_batch_fallback_response(self, actions: List[Dict]) -> str:
+    def _get_batch_fallback_response(self, actions: List["ActionRecord"]) -> str:
         """获取批量响应的备用响应"""
         lines = ["🎲 本轮行动处理中...\n"]
         for act in actions:
-            lines.append(f"• {act['character_name']} 尝试 {act['action'][:20]}...")
+            lines.append(f"• {act.character_name} 尝试 {act.action[:20]}...")
         lines.append("\n请稍等，DM正在思考结果。")
         return "\n".join(lines)
 
@@ -660,3 +660,19 @@ class ImageGenerator:
         
         # 生成图片
         return await self.generate_image(prompt, size_preset)
+
+
+# 命令与消息处理器共用的生成器实例
+_shared_generator: Optional[ImageGenerator] = None
+
+
+def get_image_generator(config: Dict[str, Any]) -> ImageGenerator:
+    """
+    获取共享的图片生成器
+
+    首次使用时创建，之后复用同一实例；传入的配置对象变化时按新配置重新创建。
+    """
+    global _shared_generator
+    if _shared_generator is None or _shared_generator.config is not config:
+        _shared_generator = ImageGenerator(config)
+    return _shared_generator